@@ -0,0 +1,69 @@
+"""Persistent caches of the compiled Jinja2 templates and of parsed files"""
+import hashlib
+import os
+import pickle
+
+import jinja2
+from jinja2 import FileSystemBytecodeCache
+
+from . import dependencies
+from .atomic import atomic_write
+
+
+class BytecodeCache(FileSystemBytecodeCache):
+    """Stores compiled templates on disk between stake invocations
+
+    Jinja2 already invalidates a cached template when the checksum of its
+    source changes. Caches are additionally stored per Jinja2 version and
+    written atomically so concurrent stake processes can share a directory.
+    """
+
+    def __init__(self, directory):
+        directory = os.path.join(directory, "jinja2-%s" % jinja2.__version__)
+        os.makedirs(directory, exist_ok=True)
+        super().__init__(directory, "%s.cache")
+
+    def dump_bytecode(self, bucket):
+        "Write the bytecode to a temporary file, then rename it"
+        try:
+            with atomic_write(self._get_cache_filename(bucket), "wb") as temp_file:
+                bucket.write_bytecode(temp_file)
+        except OSError:
+            # Another process may be clearing the cache, we can safely
+            # skip writing since the template will simply be recompiled
+            pass
+
+
+class PickleCache:
+    """Stores values parsed from files, valid while their file is unchanged
+
+    Values are pickled in one file per source file and key, along with the
+    key and the mtime and size of the source, and written atomically.
+    Subclasses can store values elsewhere by overriding get_path
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def get_path(self, path, key=""):
+        "Return the path of the cached value of a file, parsed with key options"
+        digest = hashlib.sha1(("%s\0%s" % (os.path.abspath(path), key)).encode("utf-8"))
+        return os.path.join(self.directory, "%s.pickle" % digest.hexdigest())
+
+    def load(self, path, key=""):
+        "Return the cached value of a file, or None if missing or outdated"
+        try:
+            with open(self.get_path(path, key), "rb") as cache_file:
+                stored_key, stat, value = pickle.load(cache_file)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError,
+                TypeError, AttributeError):
+            return None
+        if stored_key != key or stat != dependencies.stat(path):
+            return None
+        return value
+
+    def dump(self, path, value, key=""):
+        "Cache the value parsed from a file"
+        stat = dependencies.stat(path)
+        with atomic_write(self.get_path(path, key), "wb") as temp_file:
+            pickle.dump((key, stat, value), temp_file, pickle.HIGHEST_PROTOCOL)
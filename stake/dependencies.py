@@ -0,0 +1,141 @@
+"""Keeps track of the files a render depends on to allow incremental builds"""
+import hashlib
+import json
+import os
+from glob import glob
+
+from . import logging
+from .atomic import atomic_write
+
+# Dependencies currently recording, renders can be nested in a build
+RECORDING = []
+
+# Values that do not change the output of a render
+IGNORED_VALUES = ("file", "jobs", "verbose", "build_state")
+
+
+def record(path):
+    "Record that the renders being recorded depend on the file at path"
+    if RECORDING and path:
+        path = os.path.abspath(path)
+        for dependencies in RECORDING:
+            dependencies.files.add(path)
+
+def record_glob(pattern, matches):
+    "Record that the renders being recorded depend on the result of a glob"
+    for dependencies in RECORDING:
+        dependencies.globs[pattern] = sorted(matches)
+
+def stat(path):
+    "Return the values used to know if a file changed, None if it is missing"
+    try:
+        result = os.stat(path)
+    except OSError:
+        return None
+    return [result.st_mtime_ns, result.st_size]
+
+def signature(values):
+    "Return a hash of the values that affect every render of a build"
+    # Keys such as params.RESOLVED are markers, not values of the build
+    values = {key: value for key, value in values.items()
+              if key not in IGNORED_VALUES and not key.startswith("__")}
+    dump = json.dumps(values, sort_keys=True, default=str)
+    return hashlib.sha1(dump.encode("utf-8")).hexdigest()
+
+
+class Dependencies:
+    """Files and glob patterns touched while recording
+
+    Use as a context manager to record everything touched in its block
+    """
+
+    def __init__(self, files=(), globs=None):
+        self.files = set(files)
+        self.globs = dict(globs or {})
+
+    def update(self, other):
+        "Add the dependencies of other to these dependencies"
+        self.files.update(other.files)
+        self.globs.update(other.globs)
+        return self
+
+    def __enter__(self):
+        RECORDING.append(self)
+        return self
+
+    def __exit__(self, *_):
+        RECORDING.remove(self)
+
+
+class BuildState:
+    """Dependencies of every output of a build, persisted between builds
+
+    An output is fresh when none of the files it depends on changed and
+    its glob patterns still match the same files
+    """
+    VERSION = 1
+
+    def __init__(self, path, values_signature):
+        self.path = path
+        self.signature = values_signature
+        self.outputs = {}
+        self.stats = {}
+
+        try:
+            with open(path, "r", encoding="utf-8") as state_file:
+                state = json.load(state_file)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            logging.warning("Build state %s is corrupted, rebuilding everything", path)
+            return
+
+        if state.get("version") == self.VERSION and state.get("signature") == self.signature:
+            self.outputs = state.get("outputs", {})
+        else:
+            logging.debug("Parameters changed since last build, rebuilding everything")
+
+    def reset(self):
+        "Forget the stats of the files, before a new build"
+        self.stats = {}
+
+    def stat(self, path):
+        "Stat a file once per build"
+        if path not in self.stats:
+            self.stats[path] = stat(path)
+        return self.stats[path]
+
+    def is_fresh(self, output):
+        "Returns wether output is up to date with its dependencies"
+        entry = self.outputs.get(os.path.abspath(output))
+        if not entry or not os.path.exists(output):
+            return False
+        for path, previous in entry["files"].items():
+            if self.stat(path) != previous:
+                return False
+        for pattern, matches in entry["globs"].items():
+            if sorted(glob(pattern, recursive=True)) != matches:
+                return False
+        return True
+
+    def get_dependencies(self, output):
+        "Return the dependencies stored for an output"
+        entry = self.outputs[os.path.abspath(output)]
+        return Dependencies(entry["files"], entry["globs"])
+
+    def update(self, output, template, dependencies):
+        "Store the dependencies of an output"
+        self.outputs[os.path.abspath(output)] = {
+            "template": template,
+            "files": {path: self.stat(path) for path in sorted(dependencies.files)},
+            "globs": dependencies.globs,
+        }
+
+    def save(self):
+        "Write the build state to disk"
+        with atomic_write(self.path, "w", encoding="utf-8") as state_file:
+            json.dump({
+                "version": self.VERSION,
+                "signature": self.signature,
+                "outputs": self.outputs,
+            }, state_file)
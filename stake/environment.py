@@ -0,0 +1,25 @@
+"""Jinja2 classes of the renderer, imported only when rendering"""
+from jinja2 import Environment, Undefined
+
+from . import logging
+from . import dependencies
+
+
+class SilentUndefined(Undefined):
+    """ Dont break pageloads because vars arent there! """
+    def __init__(self, name, *args, **kwargs):
+        self.name = name
+        super().__init__(*args, **kwargs)
+
+    def _fail_with_undefined_error(self, *args, **kwargs):
+        logging.error('Variable %s was undefined!' % self.name)
+        return None
+
+
+class TrackingEnvironment(Environment):
+    """Environment that records every template loaded as a dependency"""
+
+    def _load_template(self, *args, **kwargs):
+        template = super()._load_template(*args, **kwargs)
+        dependencies.record(template.filename)
+        return template
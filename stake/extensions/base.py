@@ -1,5 +1,4 @@
 
-from jinja2 import Environment
 from stake.renderer import Renderer
 
 class Extension(Renderer):
@@ -9,7 +8,7 @@ class Extension(Renderer):
         self.renderer = renderer
         super().__init__(**kwargs)
 
-    def get_environment(self) -> Environment:
+    def get_environment(self) -> "Environment":
         """Create or extends the Jinja2 Environment,
 
         use add_extension or Overlay to extend it
@@ -22,6 +21,16 @@ class Extension(Renderer):
 
         return self.renderer.get_context_data()
 
+    def get_variants(self) -> dict:
+        "Create or extends the variants each file is rendered in"
+
+        return self.renderer.get_variants()
+
+    def refresh(self, changes):
+        "Update what the context data holds that changes affect"
+
+        return self.renderer.refresh(changes)
+
     def get_render_fn(self):
         """Return a function to render
 
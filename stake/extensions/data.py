@@ -1,50 +1,759 @@
+import itertools
 import os
-import codecs
+import weakref
+from array import array
+from concurrent.futures import ThreadPoolExecutor, wait
 from stake import params
+from stake import dependencies
+from stake.query import AttributeAccess, Index, get_value
 from . import base
 from .. import logging
 
-@params.file("data:file", short="D", help="File path of the file")
+
+# Marks the end of a lazy array, items can be None
+_MISSING = object()
+
+def import_ijson():
+    "Import the streaming JSON parser used by lazy JSON files"
+    try:
+        import ijson
+    except ImportError as e:
+        logging.error("""
+        Could not find ijson,
+
+        make sure that ijson is install with:
+        `pip install ijson` to enable lazy JSON loading
+        """)
+        raise e
+    return ijson
+
+def join_prefix(prefix, key):
+    "Return the ijson prefix of a member"
+    return "%s.%s" % (prefix, key) if prefix else str(key)
+
+def load_json_member(path, prefix):
+    """Return the value of the member of a JSON file at prefix
+
+    Objects and arrays are not parsed but returned as lazy values
+    """
+    ijson = import_ijson()
+    with open(path, "rb") as data_file:
+        for current, event, value in ijson.parse(data_file, use_float=True):
+            if current != prefix or event == "map_key":
+                continue
+            if event == "start_map":
+                return LazyJsonObject(path, prefix)
+            if event == "start_array":
+                return LazyJsonArray(path, prefix)
+            return value
+    raise KeyError(prefix)
+
+
+class LazyJsonObject(AttributeAccess):
+    """Object of a JSON file whose members are parsed on first access"""
+
+    def __init__(self, path, prefix=""):
+        self.path = path
+        self.prefix = prefix
+        self.__members = {}
+        self.__keys = None
+        self.__key_set = None
+
+    def __getitem__(self, key):
+        if key not in self.__members:
+            self.__members[key] = load_json_member(self.path, join_prefix(self.prefix, key))
+        return self.__members[key]
+
+    def __contains__(self, key):
+        if self.__key_set is None:
+            self.__key_set = frozenset(self.keys())
+        return key in self.__key_set
+
+    def keys(self) -> list:
+        "Return the keys of the object, read once"
+        if self.__keys is None:
+            ijson = import_ijson()
+            with open(self.path, "rb") as data_file:
+                self.__keys = [value for current, event, value in ijson.parse(data_file)
+                               if current == self.prefix and event == "map_key"]
+        return self.__keys
+
+    def items(self):
+        "Yield the members of the object, parsed one at a time"
+        for key in self.keys():
+            yield key, self[key]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __repr__(self):
+        return "<LazyJsonObject %s in %s>" % (self.prefix or "root", self.path)
+
+
+class LazyJsonArray:
+    """Array of a JSON file, its items are parsed one at a time while iterated
+
+    Its length is counted once without parsing the items, and an index
+    parses the items up to it
+    """
+    # Events of ijson starting an item of an array
+    ITEM_EVENTS = ("start_map", "start_array", "string", "number", "boolean", "null")
+
+    def __init__(self, path, prefix=""):
+        self.path = path
+        self.prefix = prefix
+        self.__length = None
+
+    def __iter__(self):
+        ijson = import_ijson()
+        with open(self.path, "rb") as data_file:
+            yield from ijson.items(data_file, join_prefix(self.prefix, "item"),
+                                   use_float=True)
+
+    def __len__(self):
+        if self.__length is None:
+            ijson = import_ijson()
+            prefix = join_prefix(self.prefix, "item")
+            with open(self.path, "rb") as data_file:
+                self.__length = sum(1 for current, event, _ in ijson.parse(data_file)
+                                    if current == prefix and event in self.ITEM_EVENTS)
+        return self.__length
+
+    def __bool__(self):
+        return next(iter(self), _MISSING) is not _MISSING
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            if all(value is None or value >= 0
+                   for value in (index.start, index.stop, index.step)):
+                return list(itertools.islice(self, index.start, index.stop, index.step))
+            return list(self)[index]
+        if index < 0:
+            index += len(self)
+        item = next(itertools.islice(self, index, None), _MISSING) if index >= 0 else _MISSING
+        if item is _MISSING:
+            raise IndexError(index)
+        return item
+
+    def __repr__(self):
+        return "<LazyJsonArray %s in %s>" % (self.prefix or "root", self.path)
+
+
+def load_json(path, lazy=False, **__):
+    "Parse a JSON file, or return a lazy value of its root when lazy"
+    logging.debug("Opening file %s as JSON", path)
+    if lazy:
+        return load_json_member(path, "")
+    import json
+    with open(path, "r", encoding="utf-8") as data_file:
+        return json.load(data_file)
+
+def load_yaml(path, **__):
+    "Parse a YAML file, with the C parser of libyaml when available"
+    logging.debug("Opening file %s as YAML", path)
+    try:
+        import yaml
+    except ImportError as e:
+        logging.error("""
+        Could not find yaml parser,
+
+        make sure that PyYAML is install with:
+        `pip install PyYAML` to enable yaml parsing
+        """)
+        raise e
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    with open(path, "rb") as data_file:
+        return yaml.load(data_file, Loader=loader)
+
+def iter_xml(path, tag=None):
+    """Yield tuples of (tag, value) of the elements of an XML file
+
+    Elements are converted to dicts with their attributes prefixed by @,
+    their children by tag (in a list when repeated) and their text as #text,
+    elements with only text are converted to their text. Only the root is
+    yielded or, with a tag, every element with that tag. Elements are
+    removed from the tree once converted to keep memory flat
+    """
+    from xml.etree.ElementTree import iterparse
+
+    # Open elements with their dict, None when they are not converted
+    stack = []
+    for event, element in iterparse(path, events=("start", "end")):
+        if event == "start":
+            is_converted = tag is None or element.tag == tag \
+                or (stack and stack[-1][1] is not None)
+            node = {"@" + key: value for key, value in element.attrib.items()} \
+                if is_converted else None
+            stack.append((element, node))
+            continue
+
+        _, node = stack.pop()
+        parent = stack[-1] if stack else (None, None)
+        if node is not None:
+            text = (element.text or "").strip()
+            if text and node:
+                node["#text"] = text
+            value = node or text or None
+
+            if parent[1] is None:
+                yield element.tag, value
+            elif element.tag in parent[1]:
+                siblings = parent[1][element.tag]
+                if not isinstance(siblings, list):
+                    siblings = parent[1][element.tag] = [siblings]
+                siblings.append(value)
+            else:
+                parent[1][element.tag] = value
+
+        element.clear()
+        if parent[0] is not None:
+            # The element is the last child parsed of its parent
+            del parent[0][-1]
+
+
+class XmlItems:
+    """Elements of an XML file with a tag, converted while iterated
+
+    Each iteration parses the file again, without keeping it in memory
+    """
+
+    def __init__(self, path, tag):
+        self.path = path
+        self.tag = tag
+
+    def __iter__(self):
+        for _, value in iter_xml(self.path, self.tag):
+            yield value
+
+    def __repr__(self):
+        return "<XmlItems %s in %s>" % (self.tag, self.path)
+
+
+def load_xml(path, xml_item=None, **__):
+    "Convert an XML file to a dict, or iterate over the elements of xml_item"
+    logging.debug("Opening file %s as XML", path)
+    if xml_item:
+        return XmlItems(path, xml_item)
+    return dict(iter_xml(path))
+
+class SqliteQuery:
+    """Rows of a query, fetched while iterated and kept for the build"""
+
+    def __init__(self, source, sql, parameters):
+        self.source = source
+        self.key = (sql, parameters)
+
+    def __iter__(self):
+        rows = self.source.results.get(self.key)
+        if rows is not None:
+            yield from rows
+            return
+
+        rows = []
+        for row in self.source.get_connection().execute(*self.key):
+            rows.append(row)
+            yield row
+        self.source.results[self.key] = rows
+
+    def first(self):
+        "Return the first row or None, without fetching the others"
+        return next(iter(self), None)
+
+    def __repr__(self):
+        return "<SqliteQuery %s>" % self.key[0]
+
+
+class SqliteSource:
+    """Read only SQLite database, queried from templates
+
+    {% for product in data.catalog.query("SELECT * FROM product WHERE sku = ?", sku) %}
+
+    The connection is opened on the first query and again in forked
+    processes, results are memoized for the build
+    """
+    CACHED_STATEMENTS = 256
+
+    def __init__(self, path):
+        self.path = path
+        self.results = {}
+        self.connection = None
+        self.pid = None
+
+    def get_connection(self):
+        "Return the connection of the current process"
+        if self.connection is None or self.pid != os.getpid():
+            import sqlite3
+            from urllib.parse import quote
+            uri = "file:%s?mode=ro" % quote(os.path.abspath(self.path))
+            self.connection = sqlite3.connect(
+                uri, uri=True, check_same_thread=False,
+                cached_statements=self.CACHED_STATEMENTS)
+            self.connection.row_factory = sqlite3.Row
+            self.pid = os.getpid()
+        return self.connection
+
+    def query(self, sql, *parameters) -> SqliteQuery:
+        "Return the rows of a query, fetched lazily"
+        return SqliteQuery(self, sql, parameters)
+
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+    def __repr__(self):
+        return "<SqliteSource %s>" % self.path
+
+
+def load_sqlite(path, **__):
+    "Open a SQLite database"
+    logging.debug("Opening file %s as SQLite", path)
+    return SqliteSource(path)
+
+class CsvRows:
+    """Rows of a CSV file as dicts, read while iterated
+
+    Each iteration reads the file again, without keeping it in memory
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        import csv
+        with open(self.path, "r", encoding="utf-8", newline="") as data_file:
+            yield from csv.DictReader(data_file)
+
+    def __repr__(self):
+        return "<CsvRows %s>" % self.path
+
+
+class StringColumn:
+    "Column of strings, encoded as indexes in the list of its distinct values"
+
+    def __init__(self):
+        self.values = []
+        self.codes = array("I")
+        self.indexes = {}
+
+    def append(self, value):
+        "Add a value at the end of the column"
+        code = self.indexes.get(value)
+        if code is None:
+            code = self.indexes[value] = len(self.values)
+            self.values.append(value)
+        self.codes.append(code)
+
+    def __getitem__(self, index):
+        return self.values[self.codes[index]]
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __iter__(self):
+        values = self.values
+        return (values[code] for code in self.codes)
+
+    def __getstate__(self):
+        return {"values": self.values, "codes": self.codes}
+
+    def __setstate__(self, state):
+        self.values = state["values"]
+        self.codes = state["codes"]
+        self.indexes = {value: code for code, value in enumerate(self.values)}
+
+
+class CsvRow(AttributeAccess):
+    "Row of a CsvTable, its values are read from the columns"
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    def __getitem__(self, name):
+        return self.table.columns[name][self.index]
+
+    def keys(self):
+        "Return the names of the columns"
+        return self.table.columns.keys()
+
+    def items(self):
+        "Yield the values of the row by column name"
+        for name in self.keys():
+            yield name, self[name]
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+class NullableColumn:
+    "Column of numbers with missing values, stored in a typed array"
+
+    def __init__(self, typecode):
+        self.numbers = array(typecode)
+        self.missing = set()
+
+    def append(self, value):
+        "Add a value at the end of the column, None when it is missing"
+        if value is None:
+            self.missing.add(len(self.numbers))
+            value = 0
+        self.numbers.append(value)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.numbers)
+        return None if index in self.missing else self.numbers[index]
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def __iter__(self):
+        return (None if index in self.missing else number
+                for index, number in enumerate(self.numbers))
+
+
+class CsvTable:
+    """Rows of a CSV file stored by column
+
+    Columns of integers or floats are typed arrays, others are strings
+    encoded in a list of their distinct values. As with the streamed rows,
+    blank lines are skipped and the cells missing from short rows are None,
+    empty cells of numbers are None too
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    @classmethod
+    def read(cls, path):
+        "Read a CSV file, once to find the type of the columns and once to store them"
+        import csv
+        with open(path, "r", encoding="utf-8", newline="") as data_file:
+            reader = csv.reader(data_file)
+            names = next(reader, [])
+            types = [int] * len(names)
+            has_missing = [False] * len(names)
+            for row in reader:
+                if not row:
+                    continue
+                for position in range(len(names)):
+                    value = row[position] if position < len(row) else None
+                    if not value:
+                        has_missing[position] = True
+                    else:
+                        types[position] = cls.get_type(value, types[position])
+
+        columns = {}
+        for name, kind, missing in zip(names, types, has_missing):
+            if kind is str:
+                columns[name] = StringColumn()
+            else:
+                typecode = "q" if kind is int else "d"
+                columns[name] = NullableColumn(typecode) if missing else array(typecode)
+
+        with open(path, "r", encoding="utf-8", newline="") as data_file:
+            reader = csv.reader(data_file)
+            next(reader, None)
+            appends = [(columns[name].append, kind) for name, kind in zip(names, types)]
+            for row in reader:
+                if not row:
+                    continue
+                row += [None] * (len(names) - len(row))
+                for (append, kind), value in zip(appends, row):
+                    if kind is str:
+                        append(value)
+                    else:
+                        append(kind(value) if value else None)
+        return cls(columns)
+
+    @staticmethod
+    def get_type(value, current):
+        """Return the type that can store a value and the values before it
+
+        Numbers written with leading zeros, such as zip codes, are strings
+        """
+        digits = value.lstrip("+-")
+        if "_" in value or len(digits) > 1 and digits[0] == "0" and digits[1].isdigit():
+            return str
+        if current is int:
+            try:
+                if -2 ** 63 <= int(value) < 2 ** 63:
+                    return int
+            except ValueError:
+                pass
+            current = float
+        if current is float:
+            try:
+                float(value)
+                return float
+            except ValueError:
+                pass
+        return str
+
+    def column(self, name):
+        "Return the values of a column"
+        return self.columns[name]
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return CsvRow(self, index)
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()), ()))
+
+    def __iter__(self):
+        return (CsvRow(self, index) for index in range(len(self)))
+
+    def __repr__(self):
+        return "<CsvTable %s>" % ", ".join(self.columns)
+
+
+def load_csv(path, columnar=False, **__):
+    "Stream the rows of a CSV file, or store them by column when columnar"
+    logging.debug("Opening file %s as CSV", path)
+    if columnar:
+        return CsvTable.read(path)
+    return CsvRows(path)
+
+# Functions parsing a data file by file extension
+LOADERS = {
+    ".json": load_json,
+    ".yml": load_yaml,
+    ".yaml": load_yaml,
+    ".xml": load_xml,
+    ".csv": load_csv,
+    ".db": load_sqlite,
+    ".sqlite": load_sqlite,
+    ".sqlite3": load_sqlite,
+}
+
+# Data sources being prefetched, they must be loaded before forking
+PREFETCHING = weakref.WeakSet()
+
+def wait_for_prefetch():
+    "Wait for the threads loading data sources, forking while they run could deadlock"
+    for sources in list(PREFETCHING):
+        wait(list(sources.futures.values()))
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(before=wait_for_prefetch)
+
+
+class DataSources(AttributeAccess):
+    """Data files by name, each loaded on first access
+
+    Sources can be prefetched on a thread pool, a render then only waits
+    for the sources it uses. Names that are not sources are looked up in
+    the data of the fallback file, if any
+    """
+
+    def __init__(self, paths, load_fn, fallback=None):
+        self.paths = paths
+        self.load_fn = load_fn
+        self.fallback = fallback
+        self.values = {}
+        self.futures = {}
+        self.pid = os.getpid()
+
+    def prefetch(self, threads):
+        "Start loading every source on a pool of threads"
+        executor = ThreadPoolExecutor(threads)
+        for name, path in self.paths.items():
+            future = executor.submit(self.load_fn, path)
+            future.add_done_callback(lambda future, name=name: self.loaded(name, future))
+            self.futures[name] = future
+        executor.shutdown(wait=False)
+        PREFETCHING.add(self)
+
+    def loaded(self, name, future):
+        "Keep the value of a prefetched source, forked processes can't wait on futures"
+        if not future.cancelled() and future.exception() is None:
+            self.values[name] = future.result()
+
+    def load(self, name):
+        "Return the value of a source, waiting for it if it is prefetched"
+        future = self.futures.pop(name, None)
+        if future is not None and self.pid == os.getpid():
+            return future.result()
+        return self.load_fn(self.paths[name])
+
+    def __getitem__(self, name):
+        if name not in self.values:
+            if name in self.paths:
+                self.values[name] = self.load(name)
+            elif self.fallback:
+                if self.fallback not in self.values:
+                    self.values[self.fallback] = self.load_fn(self.fallback)
+                try:
+                    return self.values[self.fallback][name]
+                except (IndexError, TypeError):
+                    # The data of the fallback file is not a mapping
+                    raise KeyError(name)
+            else:
+                raise KeyError(name)
+        return self.values[name]
+
+    def __contains__(self, name):
+        return name in self.paths
+
+    def keys(self):
+        "Return the names of the sources"
+        return self.paths.keys()
+
+    def __iter__(self):
+        return iter(self.paths)
+
+    def __repr__(self):
+        return "<DataSources %s>" % ", ".join(self.paths)
+
+
+@params.file("data:file", short="D", default=None, help="File path of the file")
+@params.string("data:cache", default=None, is_cli=False,
+               help="Directory to store parsed data files between builds")
+@params.boolean("data:lazy", default=False, is_cli=False,
+                help="Parse the members of JSON files on first access (requires ijson)")
+@params.string("data:xml_item", default=None, is_cli=False,
+               help="Tag of the XML elements to iterate over instead of loading the file")
+@params.boolean("data:columnar", default=False, is_cli=False,
+                help="Store the rows of CSV files by column in typed arrays")
+@params.array("data:indexes", default=[], is_cli=False,
+              help="Indexes built for each build or stored in data:cache, as name.key (comma separated)")
+@params.integer("data:threads", default=0, is_cli=False,
+                help="Threads loading the data sources ahead of their use (0 loads them on first use)")
+@params.namespace("data")
 class DataExtension(base.Extension):
     """ Provides extension to load a data set from a file
 
-    Can load data file from .json, .yaml and .xml based on file extension
+    Can load data file from .json, .yaml, .xml, .csv and SQLite databases
+    (.db, .sqlite) based on file extension.
+    Other values of the data section with these extensions are named data
+    sources, available as data.name
     """
+    # Values of the data section that are not data sources
+    OPTIONS = ("file", "cache", "lazy", "xml_item", "columnar", "indexes", "threads")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Declared indexes loaded from the cache, by (name, key)
+        self.__cached_indexes = {}
+
+    def get_sources(self) -> dict:
+        "Returns the paths of the data sources by name"
+        return {name: path for name, path in getattr(self, "data").items()
+                if name not in self.OPTIONS and isinstance(path, str)
+                and os.path.splitext(path)[1] in LOADERS}
+
+    def get_loader_options(self) -> dict:
+        "Returns the options given to the functions parsing data files"
+        return {"lazy": getattr(self, "lazy"), "xml_item": getattr(self, "xml_item"),
+                "columnar": getattr(self, "columnar")}
+
+    def get_declared_indexes(self) -> list:
+        "Returns the declared indexes as (name, key) tuples"
+        return [tuple(declaration.strip().rpartition(".")[::2])
+                for declaration in getattr(self, "indexes")]
+
+    def build_indexes(self, path, data) -> dict:
+        "Build the declared indexes over the data of a file, by (name, key)"
+        sources = self.get_sources()
+        f = getattr(self, "file")
+        indexes = {}
+        for name, key in self.get_declared_indexes():
+            if sources.get(name) == path:
+                items = data
+            elif f is not None and f.name == path and name not in sources:
+                items = get_value(data, name) if data is not None else None
+            else:
+                continue
+            if items is not None:
+                indexes[(name, key)] = (items, Index(items, key))
+        return indexes
 
     def load_data(self) -> dict:
         f = getattr(self, "file")
-        ext = os.path.splitext(f.name)[1]
-        if ext == '.json':
-            logging.debug("Opening file %s as JSON", f.name)
-            fileObj = codecs.open(f.name, "r", "utf-8" )
-
-            byt = fileObj.read()
-            import json
-            logging.debug("Parsing as JSON")
-            return json.loads(byt)
-            # return json.load(f)
-
-        elif ext == '.yml' or ext == '.yaml':
-            logging.debug("Opening file %s as YAML", f.name)
-            try:
-                import yaml
-                return yaml.safe_load(f)
-            except ImportError as e:
-                logging.error("""
-                Could not find yaml parser,
+        if f is None:
+            return None
+        dependencies.record(f.name)
+        return self.load_file(f.name)
+
+    def load_file(self, path):
+        "Parse a data file, through the cache directory if there is one"
+        loader = LOADERS.get(os.path.splitext(path)[1])
+        if loader is None:
+            logging.warning("Unsupported data file %s", path)
+            return None
+
+        options = self.get_loader_options()
+        cache_directory = getattr(self, "cache")
+        if not cache_directory:
+            return loader(path, **options)
 
-                make sure that PyYAML is install with:
-                `pip install PyYAML` to enable yaml parsing
-                """)
-                raise e
+        # The declared indexes are stored with the data, sharing its items
+        from stake.cache import PickleCache
+        cache = PickleCache(cache_directory)
+        key = repr((sorted(options.items()), sorted(self.get_declared_indexes())))
+        cached = cache.load(path, key)
+        if cached is None:
+            data = loader(path, **options)
+            indexes = self.build_indexes(path, data)
+            cache.dump(path, (data, indexes), key)
+        else:
+            data, indexes = cached
+            logging.debug("Loaded file %s from cache", path)
+        self.__cached_indexes.update(indexes)
+        return data
 
-        elif ext == '.xml':
-            logging.debug("Opening file %s as XML", f.name)
+    def get_data(self):
+        "Returns the data of the data file or the data sources"
+        sources = self.get_sources()
+        if not sources:
+            return self.load_data()
+
+        f = getattr(self, "file")
+        for path in list(sources.values()) + ([f.name] if f else []):
+            dependencies.record(path)
+
+        data = DataSources(sources, self.load_file, f.name if f else None)
+        if getattr(self, "threads") > 0:
+            data.prefetch(getattr(self, "threads"))
+        return data
 
     def get_context_data(self) -> dict:
-        "Extends the context data with an url function"
+        "Extends the context data with the data and an index function"
         ctxt_data = super().get_context_data()
-        ctxt_data["data"] = self.load_data()
+        data = ctxt_data["data"] = self.get_data()
+
+        # Indexes built during the build, with the items they index to keep
+        # their id from being reused
+        indexes = {}
+
+        def get_index(items, key):
+            "Return an index of items by key, built once per build"
+            if (id(items), key) not in indexes:
+                indexes[(id(items), key)] = (items, Index(items, key))
+            return indexes[(id(items), key)][1]
+
+        for name, key in self.get_declared_indexes():
+            items = get_value(data, name) if data is not None else None
+            if items is None:
+                logging.error("""
+                Could not find the data %s to index by %s.
+
+                Indexes are declared as name.key, where name is the name
+                of a data source (or a key of the data file).
+                """ % (name, key))
+                raise ValueError("Couldn't find data to index")
+            cached = self.__cached_indexes.get((name, key))
+            if cached is not None and cached[0] is items:
+                indexes[(id(items), key)] = cached
+            get_index(items, key)
+
+        ctxt_data["index"] = get_index
         return ctxt_data
 
 
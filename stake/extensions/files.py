@@ -1,20 +1,113 @@
-
+import collections
+import fnmatch
 import os
+import weakref
 from glob import glob
 
 from . import base
 from .. import logging
 from stake import params
+from stake import dependencies
+from stake.query import Query
+
+# Characters that makes a part of a pattern a wildcard
+MAGIC_CHARACTERS = ("*", "?", "[")
+
+
+def get_file_value(item, key):
+    "Return the value of key for a file, without parsing it for its metadata"
+    if key in File.METADATA:
+        return getattr(item, key)
+    try:
+        return item[key]
+    except (KeyError, IndexError, TypeError):
+        return None
+
+
+class ContentCache:
+    """Parsed contents of files, shared by every file of a build
+
+    Contents are weighted by the size of their file, and the least
+    recently used are evicted when their total is over the budget in bytes
+    """
+
+    def __init__(self, budget=None):
+        self.budget = budget
+        self.used = 0
+        self.entries = collections.OrderedDict()
+
+    def get(self, path):
+        "Return the content of a file or None if it is not cached"
+        entry = self.entries.get(path)
+        if entry is None:
+            return None
+        self.entries.move_to_end(path)
+        return entry[0]
+
+    def put(self, path, content, weight):
+        "Cache the content of a file and evict contents over the budget"
+        self.discard(path)
+        self.entries[path] = (content, weight)
+        self.used += weight
+        while self.budget is not None and self.used > self.budget and len(self.entries) > 1:
+            _, (_, evicted_weight) = self.entries.popitem(last=False)
+            self.used -= evicted_weight
+
+    def discard(self, path):
+        "Remove the content of a file from the cache"
+        entry = self.entries.pop(path, None)
+        if entry is not None:
+            self.used -= entry[1]
+
 
 class File:
-    def __init__(self, path):
+    """File matched by files(), its content is read and parsed on first use
+
+    Files are kept for the whole build, so they only hold their metadata.
+    Without a shared content cache the content is kept by the file itself.
+    Metadata is prefixed with file_ so it never hides keys of the content
+    """
+    __slots__ = ("path", "file_name", "cache_directory", "contents", "__stat", "__content")
+
+    # Keys read from the file system instead of the content
+    METADATA = ("path", "file_name", "file_mtime", "file_size")
+
+    def __init__(self, path, cache_directory=None, name=None, contents=None):
         self.path = path
-        self.content = None
+        self.file_name = name or path
+        self.cache_directory = cache_directory
+        self.contents = contents
+        self.__stat = None
+        self.__content = None
+
+    def stat(self):
+        "Stat the file once"
+        if self.__stat is None:
+            self.__stat = os.stat(self.path)
+        return self.__stat
+
+    @property
+    def file_mtime(self) -> float:
+        "Time of the last modification of the file"
+        return self.stat().st_mtime
+
+    @property
+    def file_size(self) -> int:
+        "Size of the file in bytes"
+        return self.stat().st_size
+
+    @property
+    def content(self):
+        "Parsed content of the file if it is loaded, else None"
+        if self.contents is not None:
+            return self.contents.get(self.path)
+        return self.__content
 
     def open(self):
         """ Open and read file """
+        dependencies.record(self.path)
         with open(self.path, 'r') as file:
-            return ''.join(file.readlines())
+            return file.read()
 
     def _parse_yml(self):
         try:
@@ -30,12 +123,32 @@ class File:
             raise e
 
     def parse(self):
-        if not self.content:
+        # Files are shared by renders, each render must record its dependency
+        dependencies.record(self.path)
+        content = self.content
+        if content is None:
             if self.path.endswith('yml'):
-                self.content = self._parse_yml()
+                content = self._parse_cached_yml()
+            else:
+                content = self.open()
+
+            if self.contents is not None:
+                self.contents.put(self.path, content, self.file_size)
             else:
-                self.content = self.open()
-        return self.content
+                self.__content = content
+        return content
+
+    def _parse_cached_yml(self):
+        "Parse the yaml file, through the cache directory if there is one"
+        if not self.cache_directory:
+            return self._parse_yml()
+        from stake.cache import PickleCache
+        cache = PickleCache(self.cache_directory)
+        content = cache.load(self.path)
+        if content is None:
+            content = self._parse_yml()
+            cache.dump(self.path, content)
+        return content
 
     def __str__(self):
         return self.path
@@ -45,29 +158,192 @@ class File:
 
     def __getattr__(self, attr):
         #only called what self.attr doesn't exist
+        if attr.startswith("__"):
+            raise AttributeError(attr)
         return self.parse()[attr]
 
     def __getitem__(self, attr):
         return self.parse()[attr]
 
-    pass
+
+class DirectoryIndex:
+    """Listing of a directory tree to match glob patterns against
+
+    Every directory is listed once with scandir, when a pattern first
+    reaches it, and the matches of every pattern are kept. Patterns follow
+    the rules of glob with recursive=True, ** matches any sub directory
+    """
+
+    def __init__(self, directory, cache_directory=None, budget=None):
+        self.directory = directory
+        self.cache_directory = cache_directory
+        self.contents = ContentCache(budget)
+        # Names of the sub directories and files of listed directories
+        self.listings = {}
+        self.matches = {}
+        self.files = {}
+
+    def list(self, directory):
+        "Return the names of the sub directories and of the files of a directory"
+        if directory not in self.listings:
+            directories, files = [], []
+            try:
+                with os.scandir(os.path.join(self.directory, directory)) as entries:
+                    for entry in entries:
+                        try:
+                            is_dir = entry.is_dir()
+                        except OSError:
+                            is_dir = False
+                        (directories if is_dir else files).append(entry.name)
+            except OSError:
+                pass
+            self.listings[directory] = (directories, files)
+        return self.listings[directory]
+
+    def walk(self, directory):
+        """Yield every visible path under a directory, like glob does for **
+
+        Sub directories are yielded with a trailing slash
+        """
+        directories, files = self.list(directory)
+        for name in directories:
+            if not name.startswith("."):
+                yield directory + name + "/"
+                yield from self.walk(directory + name + "/")
+        for name in files:
+            if not name.startswith("."):
+                yield directory + name
+
+    def find(self, directory, parts):
+        "Yield the paths under directory matching the parts of a pattern"
+        part, parts = parts[0], parts[1:]
+        directories, files = self.list(directory)
+
+        if part == "**":
+            if not parts:
+                # A final ** matches the directory itself and all its content
+                yield directory
+                for path in self.walk(directory):
+                    yield path.rstrip("/")
+                return
+            for candidate in [directory] + [path for path in self.walk(directory)
+                                            if path.endswith("/")]:
+                yield from self.find(candidate, parts)
+            return
+
+        names = directories if parts else directories + files
+        if any(character in part for character in MAGIC_CHARACTERS):
+            matched = [name for name in names if fnmatch.fnmatchcase(name, part)
+                       and (part.startswith(".") or not name.startswith("."))]
+        else:
+            matched = [part] if part in names else []
+
+        for name in matched:
+            if parts:
+                yield from self.find(directory + name + "/", parts)
+            else:
+                yield directory + name
+
+    @staticmethod
+    def is_outside(path) -> bool:
+        "Returns wether a path or a pattern leaves the directory"
+        path = os.path.normpath(path)
+        return os.path.isabs(path) or path == os.pardir or path.startswith(os.pardir + os.sep)
+
+    def glob(self, pattern) -> list:
+        """Return the paths matching pattern, relative to the directory
+
+        Patterns leaving the directory are not indexed and resolved by glob
+        """
+        if pattern not in self.matches:
+            if self.is_outside(pattern):
+                matches = glob(os.path.join(self.directory, pattern), recursive=True)
+                self.matches[pattern] = sorted(
+                    match if os.path.isabs(pattern) else os.path.relpath(match, self.directory)
+                    for match in matches)
+            else:
+                parts = [part for part in pattern.replace(os.sep, "/").split("/")
+                         if part not in ("", ".")]
+                self.matches[pattern] = sorted(set(self.find("", parts))) if parts else []
+        return self.matches[pattern]
+
+    def is_file(self, path):
+        "Returns wether a path matched is a file"
+        if self.is_outside(path):
+            return os.path.isfile(os.path.join(self.directory, path))
+        directory, _, name = path.rpartition("/")
+        return name in self.list(directory + "/" if directory else "")[1]
+
+    def refresh(self, paths):
+        """Forget what changed paths affect, the parsed content of the files
+        and the listings of their directories
+
+        Every match is computed again from the listings left
+        """
+        root = os.path.abspath(self.directory)
+        for path in paths:
+            path = os.path.abspath(path)
+            if not path.startswith(root + os.sep):
+                continue
+            name = os.path.relpath(path, root).replace(os.sep, "/")
+            if name in self.files:
+                self.contents.discard(self.files.pop(name).path)
+            self.listings.pop(name + "/", None)
+            directory = name
+            while directory:
+                directory = directory.rpartition("/")[0]
+                self.listings.pop(directory + "/" if directory else "", None)
+        self.matches.clear()
+
+    def get_file(self, path) -> File:
+        "Return the File at path, shared by every call"
+        if path not in self.files:
+            self.files[path] = File(os.path.join(self.directory, path),
+                                    self.cache_directory, path, self.contents)
+        return self.files[path]
+
 
 @params.boolean("files:ignore_empty", help="Do not raise an error on empty set",
                 default=False, is_cli=False)
 @params.string("files:files_directory",
                help="Working directory to resolve file paths (use same working directory as templates by default)",
                default='', is_cli=False)
+@params.string("files:cache", default=None, is_cli=False,
+               help="Directory to store parsed yaml files between builds")
+@params.integer("files:memory", default=256 * 1024 * 1024, is_cli=False,
+                help="Size in bytes of the files kept parsed in memory")
 class FileExtension(base.Extension):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.__indexes = weakref.WeakSet()
+
+    def refresh(self, changes):
+        "Forget what changed in the directory indexes of the context data"
+        for index in self.__indexes:
+            index.refresh(changes)
+        super().refresh(changes)
+
     def get_context_data(self) -> dict:
         "Add functions to fetch files information from a directory"
         ctxt = super().get_context_data()
         directory = getattr(self, "files_directory") or  getattr(self, "cwd")
         ignore_empty = getattr(self, "ignore_empty")
+        index = DirectoryIndex(directory, getattr(self, "cache"), getattr(self, "memory"))
+        self.__indexes.add(index)
 
         def get_files(pattern):
-            "Return files obtained through glob"
-            full_pattern = os.path.join(directory, pattern)
-            files = [File(f) for f in glob(full_pattern)]
+            """Return a query over the files matching the glob pattern
+
+            Files are only parsed when a key of their content is used, so
+            sorting or filtering on path, file_name, file_mtime or file_size
+            and slicing the query only parses the files returned
+            """
+            # ./posts/*.md is recorded as posts/*.md, like the index matches it
+            pattern = os.path.normpath(pattern)
+            paths = index.glob(pattern)
+            dependencies.record_glob(os.path.join(directory, pattern),
+                                     [os.path.join(directory, path) for path in paths])
+            files = [index.get_file(path) for path in paths if index.is_file(path)]
             if not len(files) and not ignore_empty:
                 logging.error("""
                 Could not find any files with the pattern %s.
@@ -80,7 +356,7 @@ class FileExtension(base.Extension):
                 ignore_empty parameter.
                 """ % (pattern, directory))
                 raise ValueError("Couldn't find any files")
-            return files
+            return Query(files, get_file_value)
 
         ctxt["files"] = get_files
         return ctxt
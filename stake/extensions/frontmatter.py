@@ -1,11 +1,182 @@
-
 import configparser
+import functools
+import hashlib
+import json
+import os
+from glob import glob
+
+import jinja2
+from jinja2 import BaseLoader, Environment
 
 from stake import params
+from stake import dependencies
+from stake.atomic import atomic_write
+from stake.query import AttributeAccess, Query
 from . import base
+from .. import logging
+
+# Jinja2 renamed contextfunction to pass_context in 3.0
+pass_context = getattr(jinja2, "pass_context", None) or jinja2.contextfunction
+
+
+# Environment attribute holding its compiled front matters, by content hash
+COMPILED = "stake_front_matters"
+
+# Tokens that makes a front matter a Jinja2 template
+JINJA2_TOKENS = ("{{", "{%", "{#")
+
+
+def compile_front_matter(config_string, jinja2_env):
+    "Return the compiled template of a front matter, compiled once per environment"
+    # Kept on the environment so the templates are freed along with it
+    templates = jinja2_env.__dict__.setdefault(COMPILED, {})
+    key = hashlib.sha1(config_string.encode("utf-8")).digest()
+    if key not in templates:
+        templates[key] = jinja2_env.from_string(config_string)
+    return templates[key]
+
+@functools.lru_cache(maxsize=1024)
+def read_config(rendered):
+    "Parse a rendered front matter, returns the items of its Page section"
+    config = configparser.ConfigParser()
+    try:
+        config.read_string(rendered)
+    except configparser.ParsingError:
+        return ()
+    return tuple(config.items("Page"))
+
+
+class FrontMatterLoader(BaseLoader):
+    """Wraps a loader to read each template once
+
+    The front matter of a template is extracted when the template is read,
+    and its source is kept until Jinja2 asks for it to compile the template
+    """
+
+    def __init__(self, loader, split_fn, strip=False):
+        self.loader = loader
+        self.split_fn = split_fn
+        self.strip = strip
+
+        # Front matter lines of every template read with its uptodate fn
+        self.front_matters = {}
+        # Sources read for their front matter, waiting to be compiled
+        self.sources = {}
+
+    def read(self, environment, template):
+        "Read a template and keep its front matter"
+        source, filename, uptodate = self.loader.get_source(environment, template)
+        lines = self.split_fn(source)
+        self.front_matters[template] = (lines, uptodate)
+
+        if self.strip and lines:
+            source = "".join(source.splitlines(True)[len(lines):])
+        self.sources[template] = (source, filename, uptodate)
+
+    def get_front_matter(self, environment, template):
+        "Returns the lines of the front matter of a template"
+        lines, uptodate = self.front_matters.get(template, (None, None))
+        if lines is None or (uptodate and not uptodate()):
+            self.read(environment, template)
+            lines, _ = self.front_matters[template]
+        return lines
+
+    def get_source(self, environment, template):
+        if template not in self.sources:
+            self.read(environment, template)
+        return self.sources.pop(template)
+
+    def list_templates(self):
+        return self.loader.list_templates()
+
+
+class Page(AttributeAccess):
+    "Front matter of a page of the site, parsed on first access"
+
+    def __init__(self, name, lines, parse_fn):
+        self.name = name
+        self.lines = lines
+        self.parse_fn = parse_fn
+        self.__meta = None
+
+    @property
+    def meta(self) -> dict:
+        "Values of the front matter"
+        if self.__meta is None:
+            self.__meta = self.parse_fn(self.lines)
+        return self.__meta
+
+    def __getitem__(self, key):
+        if key == "name":
+            return self.name
+        return self.meta[key]
+
+    def __repr__(self):
+        return self.name
+
+
+class PageIndex:
+    """Front matter of the templates of the site by template name
+
+    Templates are only read again when their mtime or size changed, and
+    the index can be persisted between builds
+    """
+    VERSION = 1
+
+    def __init__(self, directory, split_fn, path=None):
+        self.directory = directory
+        self.split_fn = split_fn
+        self.path = path
+        self.entries = {}
+        self.has_changed = False
+
+        if path:
+            try:
+                with open(path, "r", encoding="utf-8") as index_file:
+                    index = json.load(index_file)
+                if index.get("version") == self.VERSION:
+                    self.entries = index["entries"]
+            except FileNotFoundError:
+                pass
+            except ValueError:
+                logging.warning("Front matter index %s is corrupted, indexing again", path)
+
+    def update(self, pattern) -> list:
+        "Index the templates matching pattern and returns their names"
+        names = []
+        for path in sorted(glob(os.path.join(self.directory, pattern), recursive=True)):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            name = os.path.relpath(path, self.directory)
+            entry = self.entries.get(name)
+            if not entry or entry[:2] != [stat.st_mtime_ns, stat.st_size]:
+                with open(path, "r", encoding="utf-8") as opened_file:
+                    # Only the lines up to the end of the front matter are read
+                    lines = self.split_fn(opened_file)
+                self.entries[name] = [stat.st_mtime_ns, stat.st_size, lines]
+                self.has_changed = True
+            names.append(name)
+        return names
+
+    def save(self):
+        "Write the index to disk if it changed"
+        if not self.path or not self.has_changed:
+            return
+        with atomic_write(self.path, "w", encoding="utf-8") as index_file:
+            json.dump({"version": self.VERSION, "entries": self.entries}, index_file)
+        self.has_changed = False
+
 
 @params.integer("fm:allowed_skip", default=3, is_cli=False)
 @params.string("fm:identifier", short="I", default="--")
+@params.boolean("fm:strip", default=False, is_cli=False,
+                help="Strip the front matter block from the render")
+@params.string("fm:pages", default="**/*.html", is_cli=False,
+               help="Default pattern of the pages returned by pages()")
+@params.string("fm:index", default=None, is_cli=False,
+               help="File to persist the front matter of the pages between builds")
 class FrontMatterExtension(base.Extension):
     """Provides an extension that adds front matter parsing
 
@@ -14,8 +185,11 @@ class FrontMatterExtension(base.Extension):
     respect syntax highlighter
     """
 
-    def extract_lines(self, filename, jinja2_env):
-        "Extract lines of config at the beginning of the file"
+    def split_lines(self, source):
+        """Extract lines of config at the beginning of a template source
+
+        Source can be a string or an iterable of lines (like a file)
+        """
 
         has_started = False
         lines = []
@@ -24,38 +198,77 @@ class FrontMatterExtension(base.Extension):
         identifier = getattr(self, "identifier")
         # Number of lines we Could skip before reaching identifier
         allowed_skip = getattr(self, "allowed_skip")
-        template = jinja2_env.get_template(filename)
 
-        with open(template.filename, "r", encoding="utf-8") as opened_file:
-            for line in opened_file:
-                if len(lines) > allowed_skip and not has_started:
-                    # It means there was no identifier in the first lines
-                    return []
+        for line in source.splitlines() if isinstance(source, str) else source:
+            if len(lines) > allowed_skip and not has_started:
+                # It means there was no identifier in the first lines
+                return []
 
 
-                if has_started and (identifier in line):
-                    # When we reach the second identifier
-                    lines.append("")
-                    break
-                # We append skipped lines, so we can keep track of lines in
-                # file
-                lines.append(line.strip("#/ \n") if has_started else "")
+            if has_started and (identifier in line):
+                # When we reach the second identifier
+                lines.append("")
+                break
+            # We append skipped lines, so we can keep track of lines in
+            # file
+            lines.append(line.strip("#/ \n") if has_started else "")
 
-                has_started = has_started or identifier in line
+            has_started = has_started or identifier in line
 
-        return lines
+        # Short templates can end before the allowed skipped lines
+        return lines if has_started else []
+
+    def extract_lines(self, filename, jinja2_env):
+        "Extract lines of config at the beginning of the file"
+        loader = jinja2_env.loader
+        if isinstance(loader, FrontMatterLoader):
+            return loader.get_front_matter(jinja2_env, filename)
+
+        source, _, _ = loader.get_source(jinja2_env, filename)
+        return self.split_lines(source)
 
     @staticmethod
     def parse_lines(config_string, jinja2_env, **ctxt):
         "Renders and loads the config and returns its values"
         config_string = "[Page]\n%s" % config_string
-        rendered = jinja2_env.from_string(config_string).render(**ctxt)
-        config = configparser.ConfigParser()
-        try:
-            config.read_string(rendered)
-        except configparser.ParsingError:
-            return {}
-        return dict(config.items("Page"))
+        if any(token in config_string for token in JINJA2_TOKENS):
+            rendered = compile_front_matter(config_string, jinja2_env).render(**ctxt)
+        else:
+            rendered = config_string
+        return dict(read_config(rendered))
+
+    def get_environment(self) -> Environment:
+        "Read templates through a loader that keeps their front matter"
+        env = super().get_environment()
+        env.loader = FrontMatterLoader(env.loader, self.split_lines,
+                                       getattr(self, "strip"))
+        return env
+
+    def get_context_data(self) -> dict:
+        "Add a function to query the front matter of every page"
+        ctxt = super().get_context_data()
+        directory = getattr(self, "cwd")
+        index = PageIndex(directory, self.split_lines, getattr(self, "index"))
+
+        @pass_context
+        def get_pages(context, pattern=None):
+            "Return a query over the pages matching pattern"
+            pattern = pattern or getattr(self, "pages")
+            names = index.update(pattern)
+            index.save()
+
+            dependencies.record_glob(os.path.join(directory, pattern),
+                                     [os.path.join(directory, name) for name in names])
+            for name in names:
+                dependencies.record(os.path.join(directory, name))
+
+            page_ctxt = {k: v for k, v in context.get_all().items() if k != "page"}
+            def parse(lines):
+                return self.parse_lines("\n".join(lines), context.environment, **page_ctxt)
+            return Query([Page(name, index.entries[name][2], parse) for name in names])
+
+        ctxt["pages"] = get_pages
+        return ctxt
 
     def get_render_fn(self):
         "We override render function to pre-parse the file to fetch more context"
@@ -66,11 +279,7 @@ class FrontMatterExtension(base.Extension):
             page = self.parse_lines("\n".join(lines), environment, **ctxt_data)
             ctxt_data["page"] = page
 
-            output = render_fn(environment, ctxt_data, file_path)
-
-            # Before returing output, we strip the front matter block
-            # return "\n".join(output.split("\n")[len(lines):])
-            return output
+            return render_fn(environment, ctxt_data, file_path)
         return render
 
 __default__ = FrontMatterExtension
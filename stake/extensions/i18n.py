@@ -1,42 +1,151 @@
 import logging
 
 import os
+import gettext
+import hashlib
 import logging
+import pickle
 from . import base
 from stake import params
-from jinja2 import Environment
-from jinja2.ext import i18n
-from jinja2 import Environment
+from stake import dependencies
+from stake.atomic import atomic_write
+
+# Translations loaded by the process, by (locale_dir, language, mtime)
+CATALOGS = {}
+
+# Version of the format of catalogs cached on disk
+CATALOG_CACHE_VERSION = 1
+
+def load_cached_catalog(translations_cls, path):
+    "Return translations from a catalog cached on disk, None if not cached"
+    try:
+        with open(path, "rb") as cache_file:
+            cached = pickle.load(cache_file)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+    if cached.get("version") != CATALOG_CACHE_VERSION:
+        return None
+
+    translations = translations_cls()
+    translations._catalog = cached["catalog"]
+    translations._info = cached["info"]
+    translations._charset = cached["charset"]
+    if cached["plural"]:
+        translations.plural = gettext.c2py(cached["plural"])
+    else:
+        # Same default as GNUTranslations without Plural-Forms
+        translations.plural = lambda n: int(n != 1)
+    return translations
+
+def dump_cached_catalog(translations, path):
+    "Store the merged catalog of translations on disk"
+    # Extract the plural expression the same way gettext does
+    plural_forms = translations._info.get("plural-forms", "").split(";")
+    plural = plural_forms[1].split("plural=")[1] if len(plural_forms) > 1 else None
+    cached = {
+        "version": CATALOG_CACHE_VERSION,
+        "catalog": translations._catalog,
+        "info": translations._info,
+        "charset": translations._charset,
+        "plural": plural,
+    }
+    with atomic_write(path, "wb") as cache_file:
+        pickle.dump(cached, cache_file, pickle.HIGHEST_PROTOCOL)
+
 
 # TODO: Add other i18n parameters to allow better customization
-@params.string("i18n:language", help="Language for to render with", short="l")
+@params.string("i18n:language", help="Language for to render with", short="l", default=None)
+@params.array("i18n:languages", default=[],
+              help="Languages to render each file in, in a sub directory per language")
 @params.string("i18n:main", help="Main language for to render with", default=None)
 @params.string("i18n:locale_dir", help="Directory for locales", default="assets/locales")
 @params.boolean("i18n:ignore_errors", help="Ignore errors", is_cli=False, default=False)
+@params.string("i18n:catalog_cache", default=None, is_cli=False,
+               help="Directory to cache compiled catalogs in a faster format")
 class I18nExtension(base.Extension):
+    def get_language(self):
+        "Return the language of the environment, the first language by default"
+        language = getattr(self, "language") or next(iter(getattr(self, "languages")), None)
+        if not language:
+            logging.error("""
+            No language to render with.
 
+            Set either the 'language' argument or the 'languages' argument
+            via your config (under [i18n]) or via the command line.
+            """)
+            raise ValueError("No language provided")
+        return language
 
-    def get_context_data(self) -> dict:
-        "Replace current context data url function with an i18n one"
-        ctxt = super().get_context_data()
-        ctxt["lang"] = getattr(self, "language")
-        ctxt["LANG"] = getattr(self, "language")
-        ctxt["language"] = getattr(self, "language")
-        ctxt["current_lang"] = getattr(self, "language")
-        ctxt["CURRENT_LANG"] = getattr(self, "language")
-        ctxt["current_language"] = getattr(self, "language")
+    @staticmethod
+    def add_language(ctxt, language) -> dict:
+        "Set the language variables of the context and decorate its url function"
+        ctxt["lang"] = language
+        ctxt["LANG"] = language
+        ctxt["language"] = language
+        ctxt["current_lang"] = language
+        ctxt["CURRENT_LANG"] = language
+        ctxt["current_language"] = language
 
         # We decorate url function with additional lang keyword
         if "url" in ctxt:
             uri_fn = ctxt["url"]
             def get_url(*args, **kwargs):
-                kwargs['lang'] = kwargs.get("lang", ctxt["lang"])
+                kwargs['lang'] = kwargs.get("lang", language)
                 return uri_fn(*args, **kwargs)
             ctxt["url"] = get_url
 
         return ctxt
 
-    def get_translations(self):
+    def get_context_data(self) -> dict:
+        "Replace current context data url function with an i18n one"
+        ctxt = super().get_context_data()
+        return self.add_language(ctxt, self.get_language())
+
+    def get_variants(self) -> dict:
+        """Add a variant per language in 'languages'
+
+        Templates are compiled once, the translations of a variant are
+        installed through its context instead of the environment. Catalogs
+        are loaded here, before the rendering processes are forked
+        """
+        languages = getattr(self, "languages")
+        if not languages:
+            return super().get_variants()
+        variants = super().get_variants() or {None: None}
+        callables = {language: self.get_gettext_callables(language) for language in languages}
+        locale_dir = getattr(self, "locale_dir")
+
+        def get_variant(language, variant_fn):
+            "Return a function adding the language to a context data"
+            path = gettext.find("messages", locale_dir, [language])
+            def add_variant(ctxt):
+                if variant_fn:
+                    ctxt = variant_fn(ctxt)
+                # Every render of the language depends on its catalog
+                dependencies.record(path)
+                ctxt.update(callables[language])
+                return self.add_language(ctxt, language)
+            return add_variant
+
+        return {
+            os.path.join(language, name) if name else language:
+                get_variant(language, variant_fn)
+            for language in languages
+            for name, variant_fn in variants.items()
+        }
+
+    def get_gettext_callables(self, language) -> dict:
+        "Return the gettext functions Jinja2 uses to translate in a language"
+        translations = self.get_translations(language)
+        self.check_translations(translations, language)
+        return {
+            "gettext": translations.gettext,
+            "ngettext": translations.ngettext,
+            "pgettext": translations.pgettext,
+            "npgettext": translations.npgettext,
+        }
+
+    def get_translations(self, language=None):
         "Return translations for the jinja2"
         try:
             from babel.support import Translations
@@ -48,18 +157,40 @@ class I18nExtension(base.Extension):
             """)
             raise
         locale_dir = getattr(self, "locale_dir")
-        lang = getattr(self, "language")
-        return Translations.load(locale_dir, [lang])
+        lang = language or self.get_language()
+        path = gettext.find("messages", locale_dir, [lang])
+        dependencies.record(path)
 
-    def get_environment(self) -> Environment:
-        "Return a decorated environment with Jinja2 extension installed"
-        env = super().get_environment()
-        translations = self.get_translations()
+        stat = os.stat(path) if path else None
+        key = (os.path.abspath(locale_dir), lang, stat and stat.st_mtime_ns)
+        if key not in CATALOGS:
+            CATALOGS[key] = self.load_translations(Translations, path, stat, lang)
+        return CATALOGS[key]
+
+    def load_translations(self, translations_cls, path, stat, language):
+        "Load the translations of a catalog, from the catalog cache if possible"
+        locale_dir = getattr(self, "locale_dir")
+        cache_dir = getattr(self, "catalog_cache")
+        if not path or not cache_dir:
+            return translations_cls.load(locale_dir, [language])
+
+        identifier = "%s:%d:%d" % (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        cache_path = os.path.join(cache_dir, "%s-%s.catalog" % (
+            language, hashlib.sha1(identifier.encode("utf-8")).hexdigest()))
+
+        translations = load_cached_catalog(translations_cls, cache_path)
+        if translations is None:
+            translations = translations_cls.load(locale_dir, [language])
+            dump_cached_catalog(translations, cache_path)
+        return translations
+
+    def check_translations(self, translations, language):
+        "Raise an error if the catalog of a language is empty"
         if not translations._catalog and not getattr(self, "ignore_errors"):
             path = os.path.join(
                 os.getcwd(),
                 getattr(self, "locale_dir"),
-                getattr(self, "language"),
+                language,
                 "LC_MESSAGES",
                 "messages.po",
             )
@@ -70,9 +201,16 @@ class I18nExtension(base.Extension):
             %s
             """ % path)
             raise ValueError('No translations found!')
+
+    def get_environment(self) -> "Environment":
+        "Return a decorated environment with Jinja2 extension installed"
+        from jinja2.ext import i18n
+        env = super().get_environment()
+        translations = self.get_translations()
+        self.check_translations(translations, self.get_language())
         logging.debug(translations)
         env.add_extension(i18n)
-        env.install_gettext_translations(self.get_translations())
+        env.install_gettext_translations(translations)
         return env
 
 __default__ = I18nExtension
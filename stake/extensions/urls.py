@@ -2,9 +2,11 @@
 import os
 import sys
 import importlib
+import itertools
 import logging
 
 from stake import params
+from stake import dependencies
 from . import base
 
 # URL_FORMAT = ("name", {"args":"values"}, "url")
@@ -12,9 +14,155 @@ URL_NAME = 0
 URL_ARGS = 1
 URL_URL = 2
 
+# Version of the compiled url files, compiled files of other versions are ignored
+COMPILED_VERSION = 1
+COMPILED_KEY = "urls:%d" % COMPILED_VERSION
+
+
+class UrlIndex:
+    """URLS compiled for constant time lookups
+
+    Urls are grouped by name, then by the names of their arguments and by
+    the values of these arguments. The first url of URLS matching is
+    returned, as with a scan of the list.
+    """
+
+    def __init__(self, urls):
+        self.urls = list(urls)
+        # {name: {argument names: {argument values: position}}}
+        self.names = {}
+        # Urls with unhashable argument values, matched by a scan
+        self.scanned = {}
+
+        for position, url in enumerate(self.urls):
+            keys = tuple(sorted(url[URL_ARGS]))
+            values = tuple(url[URL_ARGS][key] for key in keys)
+            groups = self.names.setdefault(url[URL_NAME], {}).setdefault(keys, {})
+            try:
+                groups.setdefault(values, position)
+            except TypeError:
+                self.scanned.setdefault(url[URL_NAME], []).append(position)
+
+        self.defaults = {name: self.find(name, {"default": True}) for name in self.names}
+        self.memo = {}
+
+    def find(self, name, args):
+        "Returns the position of the first url matching name and args, or None"
+        positions = []
+        for keys, groups in self.names.get(name, {}).items():
+            if all(key in args for key in keys):
+                try:
+                    position = groups.get(tuple(args[key] for key in keys))
+                except TypeError:
+                    continue
+                if position is not None:
+                    positions.append(position)
+
+        for position in self.scanned.get(name, ()):
+            if all(key in args and args[key] == value
+                   for key, value in self.urls[position][URL_ARGS].items()):
+                positions.append(position)
+        return min(positions) if positions else None
+
+    def get(self, name, args):
+        "Returns the url matching name and args, its default url or None"
+        try:
+            memo_key = (name, frozenset(args.items()))
+            if memo_key in self.memo:
+                return self.memo[memo_key]
+        except TypeError:
+            memo_key = None
+
+        position = self.find(name, args)
+        if position is None and "default" not in args:
+            # If there is no match we use the fallback url
+            position = self.defaults.get(name)
+        url = None if position is None else self.urls[position][URL_URL]
+
+        if memo_key is not None:
+            self.memo[memo_key] = url
+        return url
+
+def get_source_path(url_path):
+    "Returns the absolute path of the python file of the urls"
+    if not url_path.endswith(".py"):
+        url_path += ".py"
+    return os.path.abspath(url_path)
+
+def get_compiled_path(source_path):
+    "Returns the default path of the compiled urls of a python file"
+    return os.path.splitext(source_path)[0] + ".pickle"
+
+def validate_urls(urls):
+    """Returns a tuple of (errors, warnings) found in a list of urls
+
+    Errors are malformed urls and urls that can never be returned because
+    an url with the same name and the same args (or a subset of them, as {})
+    is before, warnings are names with args that have no default url
+    """
+    errors, warnings = [], []
+    seen = {}
+    names_with_args, names_with_default = [], set()
+
+    for position, url in enumerate(urls):
+        if not (isinstance(url, (tuple, list)) and len(url) == 3
+                and isinstance(url[URL_NAME], str) and isinstance(url[URL_ARGS], dict)
+                and isinstance(url[URL_URL], str)):
+            errors.append("URLS[%d] %r is not a tuple of (name, args, url)" % (position, url))
+            continue
+
+        name, args = url[URL_NAME], url[URL_ARGS]
+        try:
+            key = (name, frozenset(args.items()))
+            # Urls before with a subset of the args match every call this one does
+            before = [seen[subset] for subset in (
+                (name, frozenset(items)) for size in range(len(args) + 1)
+                for items in itertools.combinations(args.items(), size)) if subset in seen]
+            if key in seen:
+                errors.append("URLS[%d] %r is never returned, URLS[%d] has the same "
+                              "name and args" % (position, url, seen[key]))
+            elif before:
+                errors.append("URLS[%d] %r is never returned, URLS[%d] has the same "
+                              "name and a subset of its args" % (position, url, min(before)))
+            seen.setdefault(key, position)
+        except TypeError:
+            pass
+
+        if all(key == "default" and value == True for key, value in args.items()):
+            names_with_default.add(name)
+        elif name not in names_with_args:
+            names_with_args.append(name)
+
+    for name in names_with_args:
+        if name not in names_with_default:
+            warnings.append("Url %s has no default, url() returns None when its args "
+                            "do not match" % name)
+    return errors, warnings
+
+def get_compiled_cache(compiled_path):
+    "Returns a pickle cache storing compiled urls at compiled_path"
+    from stake.cache import PickleCache
+
+    class CompiledCache(PickleCache):
+        def get_path(self, path, key=""):
+            return compiled_path
+
+    return CompiledCache(os.path.dirname(os.path.abspath(compiled_path)))
+
+def dump_compiled(urls, source_path, compiled_path):
+    "Writes the urls and their index to compiled_path"
+    get_compiled_cache(compiled_path).dump(source_path, (urls, UrlIndex(urls)), COMPILED_KEY)
+
+def load_compiled(source_path, compiled_path):
+    "Returns the compiled urls and their index, None if missing or outdated"
+    return get_compiled_cache(compiled_path).load(source_path, COMPILED_KEY)
+
+
 @params.string("url:urls", default="etc/urls", help=("Python file containing "
                                                        "the list of url"))
 @params.string("url:base_url", default="/", help=("Base url to prefix all urls"))
+@params.string("url:compiled", default=None, is_cli=False,
+               help="Urls compiled with `stake urls compile` (default: next to the urls)")
 class UrlExtension(base.Extension):
     """Provides an extension that loads a url
 
@@ -23,6 +171,8 @@ class UrlExtension(base.Extension):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.__urls = None
+        self.__url_file = None
+        self.__url_index = None
 
     @staticmethod
     def import_url_module(url_path):
@@ -49,6 +199,15 @@ class UrlExtension(base.Extension):
         "Load and returns the urls located in iterator / list URLS in the config"
         if not self.__urls:
             python_url_path = getattr(self, "urls")
+            source_path = get_source_path(python_url_path)
+            compiled = load_compiled(
+                source_path, getattr(self, "compiled") or get_compiled_path(source_path))
+            if compiled:
+                self.__urls, self.__url_index = compiled
+                self.__url_file = source_path
+                dependencies.record(self.__url_file)
+                return self.__urls
+
             try:
                 url_module = self.import_url_module(python_url_path)
             except ModuleNotFoundError as e:
@@ -59,27 +218,22 @@ class UrlExtension(base.Extension):
                 """ % python_url_path)
                 raise
             self.__urls = list(getattr(url_module, "URLS", []))
+            self.__url_file = getattr(url_module, "__file__", None)
+        dependencies.record(self.__url_file)
         return self.__urls
 
 
+    def get_url_index(self) -> UrlIndex:
+        "Returns the urls compiled for lookups"
+        urls = self.get_urls()
+        if self.__url_index is None:
+            self.__url_index = UrlIndex(urls)
+        return self.__url_index
+
     def get_url(self, name, **args):
         "Returns a specific url or a default one if the specific is not found"
-        base_url = getattr(self, "base_url")
-
-        def is_in(tup):
-            return tup[0] in args and tup[1] == args[tup[0]]
-
-        for url in self.get_urls():
-            if url[URL_NAME] == name:
-                is_match = all(map(is_in, url[URL_ARGS].items()))
-                if is_match:
-                    return base_url + url[URL_URL]
-
-        if "default" not in args:
-            # If there is no match we try to find a fallback url
-            return self.get_url(name, default=True)
-
-        return None
+        url = self.get_url_index().get(name, args)
+        return None if url is None else getattr(self, "base_url") + url
 
 
     def get_context_data(self) -> dict:
@@ -1,11 +1,15 @@
 import argparse
 import importlib
 import os
+import re
 import sys
+from fnmatch import fnmatch
+from glob import glob
 
 from . import logging
 from .renderer import Renderer
 from . import params
+from . import dependencies
 from .extensions.base import Extension
 
 
@@ -31,6 +35,39 @@ def import_element(path):
     return getattr(module, "__default__")
 
 
+# Renderable, environment and context data shared with the rendering processes
+WORKER_STATE = None
+
+def render_in_worker(target):
+    """Render a target (file, variant) with the state inherited from the
+    parent process
+
+    Returns a tuple of (rendered, dependencies, exception) so errors are
+    attributed to the right file even when files are sent in chunks
+    """
+    renderable, environment, context_data, variants = WORKER_STATE
+    file_path, variant = target
+    try:
+        with dependencies.Dependencies() as page_dependencies:
+            # Extensions are allowed to alter the context of a page
+            # (i.e. front matter), so each page gets its own copy
+            page_context_data = dict(context_data)
+            if variant is not None:
+                page_context_data = variants[variant](page_context_data)
+            rendered = renderable(file_path, environment, page_context_data)
+        return rendered, page_dependencies, None
+    except Exception as e:
+        return None, None, e
+
+
+def is_affected(file_dependencies, changes):
+    "Returns wether a change in changes affects a render with file_dependencies"
+    if file_dependencies.files & changes:
+        return True
+    patterns = [os.path.abspath(pattern) for pattern in file_dependencies.globs]
+    return any(fnmatch(change, pattern) for change in changes for pattern in patterns)
+
+
 class Loader:
     "Loads the different modules and renders a file with Jinja2"
 
@@ -96,9 +133,268 @@ class Loader:
         else:
             logging.setLevel(logging.WARNING)
 
+    @params.string("cwd", default=".")
+    def get_files(self, file, cwd, **__) -> list:
+        """Expand the positional files into a list of template paths
+
+        Glob patterns are resolved relatively to the templates directory (cwd)
+        and a single '-' reads the list of files from stdin, one per line.
+        """
+        files = []
+        for pattern in file:
+            if pattern == "-":
+                # Stdin is read once, watch mode only expands the patterns again
+                if self.stdin_files is None:
+                    self.stdin_files = [line.strip() for line in sys.stdin if line.strip()]
+                files.extend(self.stdin_files)
+            elif any(char in pattern for char in "*?["):
+                matches = sorted(glob(os.path.join(cwd, pattern), recursive=True))
+                if not matches:
+                    logging.warning("No template matched the pattern %s", pattern)
+                files.extend(os.path.relpath(match, cwd) for match in matches
+                             if os.path.isfile(match))
+            else:
+                files.append(pattern)
+        return files
+
+    @params.string("cwd", default=".")
+    @params.string("output_dir", default=".", help="Directory of OUTPUT for relative paths")
+    def get_batch_output(self, file_path, cwd, output_dir, variant=None, **__) -> str:
+        """Return the output path of a template rendered in batch mode
+
+        Renders of a variant are saved in a sub directory named after it
+        """
+        result_path = os.path.abspath(os.path.join(output_dir, variant or "", file_path))
+        if result_path == os.path.abspath(os.path.join(cwd, file_path)):
+            logging.error("""
+            Rendering %s in batch mode would overwrite the template itself.
+
+            Set the 'output_dir' argument to a directory different from
+            the templates directory (cwd).
+            """, file_path)
+            raise ValueError("Output would overwrite %s" % file_path)
+        return result_path
+
+    @params.string("build_state", default=None,
+                   help="File storing the dependencies of renders for incremental builds")
+    def get_build_state(self, build_state, **values):
+        "Return the state of the previous build or None if builds are not incremental"
+        if not build_state:
+            return None
+        return dependencies.BuildState(build_state, dependencies.signature(values))
+
+    def get_outputs(self, targets, **values) -> dict:
+        "Return the absolute output path of every target (None for stdout)"
+        is_batch = len({file_path for file_path, _ in targets}) != 1
+        if is_batch and values.get("output"):
+            logging.error("""
+            The 'output' argument can only be used when rendering a single file.
+
+            When rendering multiple files, each render is saved under 'output_dir'
+            with the same relative path as its template.
+            """)
+            raise ValueError("Cannot save multiple renders to a single output")
+
+        outputs = {}
+        for file_path, variant in targets:
+            if is_batch or (variant and not values.get("output")):
+                output = self.get_batch_output(file_path, variant=variant, **values)
+            else:
+                output = values.get("output") and \
+                    os.path.join(variant or "", values.get("output"))
+            outputs[(file_path, variant)] = output and \
+                os.path.abspath(os.path.join(values.get("output_dir", "."), output))
+        return outputs
+
+    def save(self, rendered, **values):
+        "Write a render to the output returned by get_output"
+        output = self.get_output(**values)
+        if output == sys.stdout:
+            output.write(rendered)
+        else:
+            output.write(rendered.encode('utf-8'))
+            output.close()
+
+    @staticmethod
+    def get_targets(files, variants) -> list:
+        "Return the (file, variant) tuples to render, variant is None without variants"
+        return [(file_path, variant) for file_path in files for variant in (variants or [None])]
+
+    def get_renderable(self, extension_classes, **values):
+        """By decoration, create a composite renderer from the extensions
+        and with the base renderer"""
+        renderable = Renderer(**values)
+        for extension in reversed(extension_classes):
+            renderable = extension(renderable, **values)
+        return renderable
+
+    def prepare(self, renderable, environment=None):
+        """Build the environment and context data shared by every render
+
+        An environment can be given to only build the context data again.
+        Returns a tuple of (environment, context_data, dependencies)
+        """
+        with dependencies.Dependencies() as build_dependencies:
+            environment = environment or renderable.get_environment()
+            context_data = renderable.get_context_data()
+        return environment, context_data, build_dependencies
+
+    @params.integer("jobs", short="j", default=1,
+                    help="Number of processes used to render multiple files")
+    def render(self, renderable, targets, prepared, jobs, **__):
+        """Render every target through the same environment and context
+
+        Yields tuples of (target, rendered, dependencies) in the same order
+        as targets
+        """
+        import multiprocessing
+        global WORKER_STATE
+        environment, context_data, build_dependencies = prepared
+        WORKER_STATE = (renderable, environment, context_data, renderable.get_variants())
+
+        jobs = min(jobs, len(targets))
+        if jobs > 1 and "fork" not in multiprocessing.get_all_start_methods():
+            logging.warning("Parallel rendering requires fork, rendering with a single process")
+            jobs = 1
+
+        if jobs > 1:
+            # Workers are forked once the environment and the context are
+            # built, so they share them with the parent process
+            logging.debug("Rendering %d files with %d processes...", len(targets), jobs)
+            pool = multiprocessing.get_context("fork").Pool(jobs)
+            renders = pool.imap(render_in_worker, targets,
+                                chunksize=max(1, len(targets) // (jobs * 4)))
+        else:
+            pool = None
+            renders = map(render_in_worker, targets)
+
+        try:
+            for target in targets:
+                logging.debug("Rendering %s...", target)
+                rendered, page_dependencies, exception = next(renders)
+                if exception:
+                    logging.error("Could not render %s", target[0])
+                    raise exception
+                yield target, rendered, page_dependencies.update(build_dependencies)
+        finally:
+            if pool:
+                pool.terminate()
+            WORKER_STATE = None
+
+    def build(self, renderable, targets, outputs, state, prepared=None, **values) -> dict:
+        """Render and save targets, then store their dependencies in the state
+
+        Returns the dependencies of every target rendered
+        """
+        graph = {}
+        if not targets:
+            return graph
+
+        logging.debug("Rendering %s...", targets)
+        prepared = prepared or self.prepare(renderable)
+        try:
+            for target, rendered, file_dependencies in \
+                    self.render(renderable, targets, prepared, **values):
+                output = outputs[target]
+                logging.debug("Saving %s to %s...", target[0], output or "terminal")
+                self.save(rendered, **dict(values, output=output))
+                if state and output:
+                    state.update(output, target[0], file_dependencies)
+                graph[target] = file_dependencies
+        finally:
+            if state:
+                state.save()
+        return graph
+
+    @params.string("cwd", default=".")
+    def get_watched_directories(self, graph, prepared, cwd, **__) -> dict:
+        """Return the directories containing the files renders depend on
+
+        Directories are mapped to wether their sub directories are watched,
+        only the templates directory (cwd) and glob patterns spanning sub
+        directories are watched recursively
+        """
+        directories = {}
+        for file_dependencies in list(graph.values()) + [prepared[2]]:
+            for path in file_dependencies.files:
+                directories.setdefault(os.path.dirname(path) or ".", False)
+            for pattern in file_dependencies.globs:
+                # Watch the part of the pattern before the first wildcard
+                prefix = os.path.dirname(re.split(r"[*?[]", pattern)[0])
+                recursive = os.sep in pattern[len(prefix) + 1:]
+                directories[prefix or "."] = directories.get(prefix or ".") or recursive
+        directories[cwd] = True
+        return directories
+
+    @params.string("output_dir", default=".", help="Directory of OUTPUT for relative paths")
+    @params.string("build_state", default=None,
+                   help="File storing the dependencies of renders for incremental builds")
+    @params.string("cwd", default=".")
+    def get_ignored_paths(self, outputs, output_dir, build_state, cwd, **__) -> set:
+        """Return the paths written by builds, which must not trigger a build
+
+        The output directory is ignored as a whole unless templates are in it
+        """
+        ignored = {output for output in outputs.values() if output}
+        if build_state:
+            ignored.add(build_state)
+        output_dir, cwd = os.path.abspath(output_dir), os.path.abspath(cwd)
+        if cwd != output_dir and not cwd.startswith(output_dir + os.sep):
+            ignored.add(output_dir)
+        return ignored
+
+    @params.boolean("watch", short="w", default=False,
+                    help="Watch for changes and render the affected files again")
+    @params.integer("debounce", default=50,
+                    help="Milliseconds without changes to wait before rendering")
+    def watch(self, extension_classes, renderable, graph, state, prepared, debounce, **values):
+        "Render files again whenever a file they depend on changes"
+        from .watch import get_watcher
+
+        watcher = get_watcher(debounce / 1000)
+        targets = self.get_targets(self.get_files(**values), renderable.get_variants())
+        while True:
+            watcher.ignore(self.get_ignored_paths(self.get_outputs(targets, **values), **values))
+            directories = self.get_watched_directories(graph, prepared, **values)
+            watcher.watch([d for d, recursive in directories.items() if recursive])
+            watcher.watch([d for d, recursive in directories.items() if not recursive],
+                          recursive=False)
+            logging.info("Watching for changes...")
+            changes = watcher.wait()
+            logging.debug("Changed files: %s", changes)
+
+            targets = self.get_targets(self.get_files(**values), renderable.get_variants())
+            python_files = {path for path in changes if path.endswith(".py")}
+            if python_files or changes & prepared[2].files:
+                # Data, translations or url modules changed, the environment
+                # and context must be built again
+                for name, module in list(sys.modules.items()):
+                    if os.path.abspath(getattr(module, "__file__", None) or "") in python_files:
+                        del sys.modules[name]
+                renderable = self.get_renderable(extension_classes, **values)
+                prepared = self.prepare(renderable)
+                affected = targets
+            else:
+                # Loaded data is kept, only what the changes affect is reset
+                renderable.refresh(changes)
+                affected = [target for target in targets
+                            if target not in graph or is_affected(graph[target], changes)]
+
+            if state:
+                state.reset()
+            try:
+                outputs = self.get_outputs(targets, **values)
+                graph.update(self.build(renderable, affected, outputs, state,
+                                        prepared, **values))
+            except Exception as e:
+                logging.error("(%s): %s", e.__class__.__name__, e)
+
     def __init__(self):
+        self.stdin_files = None
         self.parser = argparse.ArgumentParser(conflict_handler="resolve")
-        self.parser.add_argument("file", help="Relative file path")
+        self.parser.add_argument("file", nargs="+", help=(
+            "Relative file paths or glob patterns to render "
+            "(use - to read the list of files from stdin)"))
 
     def parse_args(self, previous=None):
         "Parse arguments and update them with the new values"
@@ -125,29 +421,79 @@ class Loader:
 
         # Finally load extensions and reparse values
         # based on extensions
-        extensions = list(self.get_extensions(**values))
+        extension_classes = list(self.get_extensions(**values))
         logging.debug("Reparsing CLI arguments with new extensions loaded...")
         values = self.parse_args(values)
 
-        logging.debug("Rendering %s with extensions %s...", values.get("file"), extensions)
-        # By decoration, create a composite renderer from the extensions
-        # and with the base renderer
-        renderable = Renderer(**values)
-        while extensions:
-            renderable = extensions.pop()(renderable, **values)
+        # Values are cast once and shared by every extension
+        values = params.resolve(values)
 
-        rendered = renderable(values.get("file"))
+        logging.debug("Loading extensions %s...", extension_classes)
+        renderable = self.get_renderable(extension_classes, **values)
 
-        logging.debug("Saving %s to %s...", values.get("file"), values.get("output") or "terminal")
-        output = self.get_output(**values)
-        if output == sys.stdout:
-            output.write(rendered)
-        else:
-            output.write(rendered.encode('utf-8'))
-        output.close()
+        targets = self.get_targets(self.get_files(**values), renderable.get_variants())
+        outputs = self.get_outputs(targets, **values)
+        graph = {}
+
+        state = self.get_build_state(**values)
+        if state:
+            # Only render targets with an output that is not up to date
+            for target in targets:
+                if outputs[target] and state.is_fresh(outputs[target]):
+                    graph[target] = state.get_dependencies(outputs[target])
+            targets = [target for target in targets if target not in graph]
+            logging.debug("%d files are up to date", len(graph))
+
+        prepared = self.prepare(renderable) if values.get("watch") else None
+        graph.update(self.build(renderable, targets, outputs, state, prepared, **values))
+
+        if values.get("watch"):
+            try:
+                self.watch(extension_classes, renderable, graph, state, prepared, **values)
+            except KeyboardInterrupt:
+                pass
+
+def compile_urls(argv) -> int:
+    "Validates the urls of a python file and compiles them, returns the exit code"
+    from .extensions import urls
+
+    parser = argparse.ArgumentParser(
+        prog="stake urls compile",
+        description="Validate URLS and compile them to load them faster")
+    parser.add_argument("urls", nargs="?", default=None, help=(
+        "Python file containing the list of url "
+        "(default: url:urls of the config file or etc/urls)"))
+    parser.add_argument("-c", "--config_file", help="Relative path to the config file")
+    parser.add_argument("-o", "--output", default=None, help=(
+        "File to write the compiled urls to (default: next to the python file)"))
+    args = parser.parse_args(argv)
+    logging.setLevel(logging.INFO)
+
+    url_path = args.urls
+    if not url_path and args.config_file:
+        from stake.config.ini import parser as config_parser
+        url_path = config_parser(config_file=args.config_file).get("url:urls")
+    url_path = url_path or "etc/urls"
+
+    source_path = urls.get_source_path(url_path)
+    url_list = list(getattr(urls.UrlExtension.import_url_module(url_path), "URLS", []))
+    errors, warnings = urls.validate_urls(url_list)
+    for warning in warnings:
+        logging.warning(warning)
+    for error in errors:
+        logging.error(error)
+    if errors:
+        return 1
+
+    output = args.output or urls.get_compiled_path(source_path)
+    urls.dump_compiled(url_list, source_path, output)
+    logging.info("Compiled %d urls to %s", len(url_list), output)
+    return 0
 
 def main():
     try:
+        if sys.argv[1:3] == ["urls", "compile"]:
+            exit(compile_urls(sys.argv[3:]))
         Loader()()
     except Exception as e:
         logging.error("(%s): %s", e.__class__.__name__, e)
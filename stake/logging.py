@@ -1,25 +1,38 @@
 import sys
 import logging
-import colorlog
 import textwrap
 
-class CustomFormatter(colorlog.ColoredFormatter):
-    """ Colored formatter that removes indentation caused by triple quotes """
+FORMAT = '[%(levelname)s]: %(message)s'
+
+class CustomFormatter(logging.Formatter):
+    """ Formatter that removes indentation caused by triple quotes """
     def format(self, record):
         if isinstance(record.msg, str):
             record.msg = textwrap.dedent(record.msg)
         return super().format(record)
 
+def get_formatter(stream):
+    "Returns a colored formatter if stream is a terminal, colorlog is only imported then"
+    is_tty = getattr(stream, "isatty", None)
+    if is_tty and is_tty():
+        try:
+            import colorlog
+        except ImportError:
+            pass
+        else:
+            class ColoredFormatter(CustomFormatter, colorlog.ColoredFormatter):
+                pass
+            return ColoredFormatter('%(log_color)s' + FORMAT)
+    return CustomFormatter(FORMAT)
+
 # Configure Logger
-LOGGER = colorlog.getLogger()
-HANDLER = colorlog.StreamHandler(sys.stdout)
-HANDLER.setFormatter(CustomFormatter(
-	'%(log_color)s[%(levelname)s]: %(message)s'))
+LOGGER = logging.getLogger()
+HANDLER = logging.StreamHandler(sys.stdout)
+HANDLER.setFormatter(get_formatter(sys.stdout))
 HANDLER.addFilter(lambda record: record.levelno != logging.ERROR)
 
-ERROR_HANDLER = colorlog.StreamHandler(sys.stderr)
-ERROR_HANDLER.setFormatter(CustomFormatter(
-	'%(log_color)s[%(levelname)s]: %(message)s'))
+ERROR_HANDLER = logging.StreamHandler(sys.stderr)
+ERROR_HANDLER.setFormatter(get_formatter(sys.stderr))
 ERROR_HANDLER.addFilter(lambda record: record.levelno == logging.ERROR)
 
 LOGGER.addHandler(HANDLER)
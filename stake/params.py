@@ -1,6 +1,9 @@
 #-- Imports
 import types
+import functools
+import itertools
 import logging
+import weakref
 
 LOGGER = logging.getLogger("stake")
 
@@ -8,6 +11,19 @@ __all__ = ["string", "boolean", "integer", "choice", "array"]
 #-- Constants
 ARGPARSE_PARAMETERS = set()
 
+# Counts the parameters declared, parameters with the same name are
+# resolved in the order they are declared
+DECLARATIONS = itertools.count()
+
+# Key of the names of the parameters already cast in values returned by resolve
+RESOLVED = "__resolved__"
+
+# Key of the values of every namespace in values returned by resolve
+NAMESPACES = "__namespaces__"
+
+# Argparse actions of the parameters already added to each parser
+PARSER_ACTIONS = weakref.WeakKeyDictionary()
+
 #-- Exceptions
 class ParsingError(Exception):
     """Triggered when there is an error parsing a parameter"""
@@ -41,15 +57,26 @@ class InvalidCastError(ParsingError):
         )
 
 
+@functools.lru_cache(maxsize=None)
 def get_value(key):
     "Returns value name of a key in format namespace:key"
-    return key.split(":")[-1]
+    return key.rpartition(":")[2]
 
+@functools.lru_cache(maxsize=None)
 def get_namespace(key):
     "Returns the namespace of a key in a format namespace:key"
     if not ":" in key:
         return None
-    return ".".join(key.split(":")[:-1])
+    return key.rpartition(":")[0].replace(":", ".")
+
+def index_namespaces(values) -> dict:
+    "Returns the values of each namespace as {namespace: {key: value}}"
+    namespaces = {}
+    for key, value in values.items():
+        namespace = get_namespace(key) if isinstance(key, str) else None
+        if namespace is not None:
+            namespaces.setdefault(namespace, {})[get_value(key)] = value
+    return namespaces
 
 #-- Classes
 class Parameter():
@@ -74,6 +101,7 @@ class Parameter():
         self.argparse_kwargs = argparse_kwargs
 
         # We register the instance of the parameter to our singleton
+        self.order = next(DECLARATIONS)
         ARGPARSE_PARAMETERS.add(self)
 
     def __call__(self, wrapped):
@@ -81,11 +109,21 @@ class Parameter():
         is_fn = isinstance(wrapped, types.FunctionType)
         wrapped_fn = wrapped if is_fn else wrapped.__init__
 
+        # Stacked decorators share the wrapper of the first one applied, the
+        # parameters of the decorators higher in the stack are parsed first
+        wrapper = wrapped if is_fn else wrapped.__dict__.get("__init__")
+        if hasattr(wrapper, "parameters"):
+            wrapper.parameters.insert(0, self)
+            return wrapped
+
+        parameters = [self]
+
         def validate_args(*args, **kwargs):
             "Wrapping function that validates the args sent"
             # We get the namespace of the current argument
             try:
-                return wrapped_fn(*args, **self.parse(kwargs, name=wrapped.__name__))
+                return wrapped_fn(*args, **parse_parameters(parameters, kwargs,
+                                                            name=wrapped.__name__))
             except TypeError as e:
                 args = str(e).split(":")[-1]
                 LOGGER.error("""
@@ -97,6 +135,7 @@ class Parameter():
                 Original error: {}""".format(args, wrapped_fn.__name__ if is_fn else wrapped.__name__, str(e)))
                 raise
 
+        validate_args.parameters = parameters
         if not is_fn:
             wrapped.__init__ = validate_args
             return wrapped # If is a class we return a class
@@ -110,7 +149,11 @@ class Parameter():
     def parse(self, kwargs, name=None):
         """Change parameter object value for this parameter on kwargs"""
         kwargs = kwargs.copy()
+        kwargs[get_value(self.name)] = self.resolve(kwargs, name)
+        return kwargs
 
+    def resolve(self, kwargs, name=None):
+        """Returns the value of this parameter in kwargs, cast to its type"""
         if self.name in kwargs:
             # We try first to get the value directly
             value = kwargs[self.name]
@@ -125,12 +168,11 @@ class Parameter():
 
         # Convert the value to the desired type
         try:
-            kwargs[get_value(self.name)] = self.convert(value)
+            return self.convert(value)
         except ValueError as error:
             # Wrap value error in an Invalid cast error for
             # a more precise error message
             raise InvalidCastError(error, self, name)
-        return kwargs
 
 
 class StringParameter(Parameter):
@@ -171,6 +213,7 @@ class FileParameter(Parameter):
         super().__init__(name, *args, **argparse_kwargs)
 
     def convert(self, value):
+        if value is None: return None
         try:
             return open(value, mode=self.file_mode)
         except FileNotFoundError:
@@ -204,14 +247,19 @@ class NamespaceParameter(Parameter):
         "Returns a dict populated with all values of kwargs"
 
         kwargs = kwargs.copy()
-        values = {}
+        kwargs[self.name] = self.resolve(kwargs, name)
+        return kwargs
+
+    def resolve(self, kwargs, name=None):
+        "Returns the values of kwargs in the namespace"
+        if NAMESPACES in kwargs:
+            return dict(kwargs[NAMESPACES].get(self.name, {}))
 
+        values = {}
         for key in kwargs:
             if self.name == get_namespace(key):
                 values[get_value(key)] = kwargs[key]
-
-        kwargs[self.name] = values
-        return kwargs
+        return values
 
 
 def argparser_arguments(parameter, default_values=None):
@@ -253,10 +301,64 @@ namespace = NamespaceParameter
 file = FileParameter
 
 #-- Public function
+def get_parameters() -> list:
+    "Returns the registered parameters in the order they were declared"
+    return sorted(ARGPARSE_PARAMETERS, key=lambda parameter: parameter.order)
+
+def parse_parameters(parameters, kwargs, name=None):
+    """Returns a copy of kwargs with the values of parameters
+
+    Values already cast by resolve are used as is
+    """
+    kwargs = dict(kwargs)
+    resolved = kwargs.get(RESOLVED, ())
+    for parameter in parameters:
+        key = parameter.name if isinstance(parameter, NamespaceParameter) \
+            else get_value(parameter.name)
+        if parameter.name in resolved:
+            kwargs[key] = kwargs[parameter.name]
+        else:
+            kwargs[key] = parameter.resolve(kwargs, name)
+    return kwargs
+
+def resolve(values):
+    """Cast the values of every parameter once
+
+    Returns an immutable mapping of values where the value of each
+    parameter is cast, decorated functions then use them as is. The
+    values of each namespace are indexed once under NAMESPACES. When
+    parameters share a name, the first one declared is used
+    """
+    values = dict(values)
+    values[NAMESPACES] = index_namespaces(values)
+    resolved = dict(values)
+    names = set()
+    for parameter in get_parameters():
+        if parameter.name in names:
+            continue
+        try:
+            resolved[parameter.name] = parameter.resolve(values)
+        except ParsingError:
+            # Parameters not used by this run are validated when used
+            continue
+        names.add(parameter.name)
+    resolved[RESOLVED] = frozenset(names)
+    return types.MappingProxyType(resolved)
+
 def add_arguments(parser, default_values=None):
-    """Transform an argparser based on the loaded classes"""
-    for parameter in ARGPARSE_PARAMETERS:
+    """Transform an argparser based on the loaded classes
+
+    Parameters already added to the parser only get their default updated
+    """
+    actions = PARSER_ACTIONS.setdefault(parser, {})
+    for parameter in get_parameters():
+        if parameter in actions:
+            action = actions[parameter]
+            if action and default_values and parameter.name in default_values:
+                action.default = default_values[parameter.name]
+                action.required = False
+            continue
+
         args, kwargs = argparser_arguments(parameter, default_values)
-        if args:
-            parser.add_argument(*args, **kwargs)
+        actions[parameter] = parser.add_argument(*args, **kwargs) if args else None
     return parser
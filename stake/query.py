@@ -0,0 +1,212 @@
+"""Lazy and chainable queries over collections, callable from templates"""
+import operator
+
+# Lookups available in where, as key__lookup=value
+LOOKUPS = {
+    "eq": operator.eq,
+    "ne": operator.ne,
+    "gt": lambda value, other: value is not None and value > other,
+    "gte": lambda value, other: value is not None and value >= other,
+    "lt": lambda value, other: value is not None and value < other,
+    "lte": lambda value, other: value is not None and value <= other,
+    "in": lambda value, values: value in values,
+    "contains": lambda value, item: value is not None and item in value,
+}
+
+
+def get_value(item, key):
+    "Return the value of key for an item, either by index or by attribute"
+    try:
+        return item[key]
+    except (KeyError, IndexError, TypeError):
+        return getattr(item, key, None)
+
+
+class AttributeAccess:
+    """Mixin giving access to items as attributes, as in {{ item.key }}
+
+    Names starting with an underscore are never looked up in items
+    """
+    __slots__ = ()
+
+    def __getattr__(self, key):
+        # Only called when the attribute doesn't exist
+        if key.startswith("_"):
+            raise AttributeError(key)
+        try:
+            return self[key]
+        except KeyError:
+            raise AttributeError(key)
+
+
+class Query:
+    """Query over a list of items, evaluated when first iterated
+
+    Filters, ordering and slicing are stored until the query is evaluated,
+    so only the keys used are read from items and only the items returned
+    need to be loaded.
+
+    {% for post in query.where(draft="no").order_by("-date").limit(10) %}
+    """
+
+    def __init__(self, items, getter=get_value):
+        self.items = items
+        self.getter = getter
+        self.filters = ()
+        self.ordering = ()
+        self.start = 0
+        self.stop = None
+        self.__result = None
+
+    def clone(self, **attributes):
+        "Return a copy of the query with different attributes"
+        query = self.__class__(self.items, self.getter)
+        query.filters = self.filters
+        query.ordering = self.ordering
+        query.start = self.start
+        query.stop = self.stop
+        for name, value in attributes.items():
+            setattr(query, name, value)
+        return query
+
+    def where(self, *predicates, **conditions):
+        """Filter items with predicates or conditions on their keys
+
+        Conditions are key=value or key__lookup=value, see LOOKUPS
+        """
+        filters = list(predicates)
+        for condition, expected in conditions.items():
+            key, _, lookup = condition.partition("__")
+            compare = LOOKUPS[lookup or "eq"]
+            filters.append(lambda item, key=key, compare=compare, expected=expected:
+                           compare(self.getter(item, key), expected))
+        return self.clone(filters=self.filters + tuple(filters))
+
+    def order_by(self, *keys):
+        "Sort items by keys, prefix a key with - to sort in descending order"
+        return self.clone(ordering=self.ordering + keys)
+
+    def offset(self, count):
+        "Skip the first count items"
+        stop = self.stop if self.stop is None else max(self.stop, self.start + count)
+        return self.clone(start=self.start + count, stop=stop)
+
+    def limit(self, count):
+        "Return at most count items"
+        stop = self.start + count
+        return self.clone(stop=stop if self.stop is None else min(self.stop, stop))
+
+    def page(self, number, size):
+        "Return the items of a page, numbered from 1"
+        return self.offset((number - 1) * size).limit(size)
+
+    def pages(self, size):
+        "Return the number of pages of size items"
+        return max(1, -(-self.count() // size))
+
+    def count(self):
+        "Return the number of items"
+        return len(self.evaluate())
+
+    def first(self):
+        "Return the first item or None"
+        items = self.limit(1).evaluate()
+        return items[0] if items else None
+
+    def sort_key(self, key):
+        "Return a sort key function which sorts None values first"
+        def get_key(item):
+            value = self.getter(item, key)
+            return (value is not None, value)
+        return get_key
+
+    def evaluate(self) -> list:
+        "Apply filters, ordering and slicing and returns the list of items"
+        if self.__result is None:
+            items = self.items
+            for item_filter in self.filters:
+                items = [item for item in items if item_filter(item)]
+            items = list(items)
+
+            # Stable sorts in reverse order of the keys sort by every key
+            for key in reversed(self.ordering):
+                reverse = key.startswith("-")
+                items.sort(key=self.sort_key(key.lstrip("-")), reverse=reverse)
+
+            self.__result = items[self.start:self.stop]
+        return self.__result
+
+    def __iter__(self):
+        return iter(self.evaluate())
+
+    def __len__(self):
+        return self.count()
+
+    def __bool__(self):
+        return bool(self.evaluate())
+
+    def __getitem__(self, index):
+        if isinstance(index, slice) and (index.step or 1) == 1 \
+                and (index.start or 0) >= 0 and (index.stop is None or index.stop >= 0):
+            query = self.offset(index.start or 0)
+            if index.stop is not None:
+                query = query.limit(max(0, index.stop - (index.start or 0)))
+            return query
+        return self.evaluate()[index]
+
+    def __repr__(self):
+        return "<Query %r>" % self.evaluate()
+
+
+class Index:
+    """Items grouped by the value of a key, for constant time lookups
+
+    {% set products = index(data.products, "sku") %}
+    {{ products.get(sku).name }} {{ products.all(sku)|length }}
+
+    Items with an unhashable value (a list or a mapping) are not indexed
+    """
+
+    def __init__(self, items, key, getter=get_value):
+        self.key = key
+        self.groups = {}
+        for item in items:
+            try:
+                self.groups.setdefault(getter(item, key), []).append(item)
+            except TypeError:
+                continue
+
+    def get(self, value, default=None):
+        "Return the first item with value or default"
+        group = self.all(value)
+        return group[0] if group else default
+
+    def all(self, value) -> list:
+        "Return every item with value"
+        try:
+            return self.groups.get(value, [])
+        except TypeError:
+            return []
+
+    def keys(self):
+        "Return the values of the key"
+        return self.groups.keys()
+
+    def items(self):
+        "Return tuples of (value, items) for every value"
+        return self.groups.items()
+
+    def __getitem__(self, value):
+        return self.groups[value][0]
+
+    def __contains__(self, value):
+        return bool(self.all(value))
+
+    def __iter__(self):
+        return iter(self.groups)
+
+    def __len__(self):
+        return len(self.groups)
+
+    def __repr__(self):
+        return "<Index by %s>" % self.key
@@ -1,25 +1,19 @@
 import os
-import logging
-
 import unicodedata
 import re
 
 from . import logging
+from . import params
 
-from jinja2 import Environment, BaseLoader, FileSystemLoader, TemplateNotFound, \
-    UndefinedError, Undefined
-
-class SilentUndefined(Undefined):
-    """ Dont break pageloads because vars arent there! """
-    def __init__(self, name, *args, **kwargs):
-        self.name = name
-        super().__init__(*args, **kwargs)
-
-    def _fail_with_undefined_error(self, *args, **kwargs):
-        logging.error('Variable %s was undefined!' % self.name)
-        return None
+def __getattr__(name):
+    """Jinja2 classes of the renderer are imported on first access
 
-from . import params
+    Jinja2 is only imported when rendering, so other commands start faster
+    """
+    if name in ("SilentUndefined", "TrackingEnvironment"):
+        from . import environment
+        return getattr(environment, name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
 
 def slugify(string):
     slug = unicodedata.normalize('NFKD', string)
@@ -29,6 +23,8 @@ def slugify(string):
     return slug.decode('utf-8')
 
 @params.string("cwd", default=".")
+@params.string("bytecode_cache", default=None,
+               help="Directory where compiled templates are cached between runs")
 @params.boolean("silence_undefined", default=False,
                 help="Option to silence undefined variable in template rendering")
 @params.namespace("site")
@@ -39,16 +35,29 @@ class Renderer:
         for k, item in kwargs.items():
             setattr(self, k, item)
 
-    def get_loader(self) -> BaseLoader:
+    def get_loader(self) -> "BaseLoader":
         """Returns a Jinja2 Loader object for rendering"""
+        from jinja2 import FileSystemLoader
         return FileSystemLoader(getattr(self, "cwd"))
 
-    def get_environment(self) -> Environment:
+    def get_bytecode_cache(self):
+        """Returns a Jinja2 bytecode cache or None if caching is disabled"""
+        directory = getattr(self, "bytecode_cache")
+        if not directory:
+            return None
+        from .cache import BytecodeCache
+        return BytecodeCache(directory)
+
+    def get_environment(self) -> "Environment":
         """Returns the jinja2 environment"""
+        from .environment import SilentUndefined, TrackingEnvironment
+        kwargs = {
+            "loader": self.get_loader(),
+            "bytecode_cache": self.get_bytecode_cache(),
+        }
         if self.silence_undefined:
-            env = Environment(loader=self.get_loader(), undefined=SilentUndefined)
-        else:
-            env = Environment(loader=self.get_loader())
+            kwargs["undefined"] = SilentUndefined
+        env = TrackingEnvironment(**kwargs)
         env.filters['slug'] = slugify
         return env
 
@@ -58,6 +67,19 @@ class Renderer:
             "site": getattr(self, "site")
         }
 
+    def get_variants(self) -> dict:
+        """Returns the variants to render each file in, as a dict of the
+        name of the variant to a callable that takes and returns ctxt_data
+
+        Renders of a variant are saved in a sub directory named after it
+        """
+        return {}
+
+    def refresh(self, changes):
+        """Called in watch mode with the paths that changed, before the
+        affected files are rendered again with the same context data"""
+        pass
+
     def get_render_fn(self):
         """Return a callable that takes environment, ctxt_data and file"""
         def render(environment, ctxt_data, file_path):
@@ -68,15 +90,19 @@ class Renderer:
             return template.render(**ctxt_data)
         return render
 
-    def __call__(self, file_path) -> str:
+    def __call__(self, file_path, environment=None, context_data=None) -> str:
         """Render a file.
 
         Calls get_render_fn and inputs get_environment(),
-        get_context_data() and returns the render
+        get_context_data() and returns the render. An environment and
+        context data can be provided to share them between multiple renders.
         """
+        from jinja2 import TemplateNotFound, UndefinedError
         render = self.get_render_fn()
-        environment = self.get_environment()
-        context_data = self.get_context_data()
+        if environment is None:
+            environment = self.get_environment()
+        if context_data is None:
+            context_data = self.get_context_data()
 
         try:
             return render(environment, context_data, file_path)
@@ -0,0 +1,192 @@
+"""Watch directories for changes, with inotify when available"""
+import abc
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+from . import logging
+
+# Inotify flags (see inotify.h)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class Watcher(abc.ABC):
+    """Base watcher, waits for changes in directories and debounces them
+
+    Subclasses implement read, which returns the paths changed before timeout
+    """
+
+    def __init__(self, debounce=0.05):
+        self.debounce = debounce
+        # Watched directories, mapped to wether their sub directories are watched
+        self.directories = {}
+        self.ignored = set()
+
+    def watch(self, directories, recursive=True):
+        "Add directories (and their sub directories if recursive) to the watched directories"
+        for directory in sorted(os.path.abspath(d) for d in directories):
+            is_watched = any(
+                directory == watched and (is_recursive or not recursive)
+                or is_recursive and directory.startswith(watched + os.sep)
+                for watched, is_recursive in self.directories.items())
+            if not is_watched and os.path.isdir(directory) and not self.is_ignored(directory):
+                self.directories[directory] = recursive
+                self.add(directory, recursive)
+
+    def ignore(self, paths):
+        "Ignore changes to paths, the files under them and their temporary files"
+        self.ignored.update(os.path.abspath(path) for path in paths if path)
+
+    def is_ignored(self, path) -> bool:
+        "Returns wether changes to path are ignored"
+        return any(path == ignored or path.startswith(ignored + os.sep)
+                   or path.startswith(ignored + ".") and path.endswith(".tmp")
+                   for ignored in self.ignored)
+
+    def walk(self, directory, recursive=True):
+        "Yield the directory and its sub directories that are not ignored"
+        yield directory
+        if not recursive:
+            return
+        for root, directories, _ in os.walk(directory):
+            directories[:] = [name for name in directories
+                              if not self.is_ignored(os.path.join(root, name))]
+            for name in directories:
+                yield os.path.join(root, name)
+
+    @abc.abstractmethod
+    def add(self, directory, recursive=True):
+        "Start watching a new directory"
+
+    @abc.abstractmethod
+    def read(self, timeout=None):
+        "Return the set of paths that changed before timeout (None to block)"
+
+    def wait(self):
+        "Block until there are changes and no new ones for the debounce delay"
+        changes = set()
+        while not changes:
+            changes = {path for path in self.read() if not self.is_ignored(path)}
+        while True:
+            more = {path for path in self.read(self.debounce) if not self.is_ignored(path)}
+            if not more:
+                return changes
+            changes |= more
+
+
+class PollingWatcher(Watcher):
+    """Watcher that compares the stats of every file at an interval"""
+
+    def __init__(self, debounce=0.05, interval=0.2):
+        super().__init__(debounce)
+        self.interval = interval
+        self.snapshot = {}
+
+    def scan(self):
+        "Return the modification time and size of every watched file"
+        snapshot = {}
+        for root, recursive in self.directories.items():
+            for directory in self.walk(root, recursive):
+                try:
+                    entries = list(os.scandir(directory))
+                except OSError:
+                    continue
+                for entry in entries:
+                    try:
+                        if entry.is_dir():
+                            continue
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    snapshot[entry.path] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def add(self, directory, recursive=True):
+        pass
+
+    def watch(self, directories, recursive=True):
+        super().watch(directories, recursive)
+        self.snapshot = self.scan()
+
+    def read(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            snapshot = self.scan()
+            changes = {path for path in snapshot.keys() | self.snapshot.keys()
+                       if snapshot.get(path) != self.snapshot.get(path)}
+            self.snapshot = snapshot
+            if changes or (deadline and time.monotonic() >= deadline):
+                return changes
+            time.sleep(min(self.interval, timeout or self.interval))
+
+
+class InotifyWatcher(Watcher):
+    """Watcher relying on the Linux inotify API through libc"""
+    MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+    def __init__(self, libc, debounce=0.05):
+        super().__init__(debounce)
+        self.libc = libc
+        # Watched directories by descriptor, with wether new sub directories are watched
+        self.descriptors = {}
+        self.fd = libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "Could not initialize inotify")
+
+    def add(self, directory, recursive=True):
+        for root in self.walk(directory, recursive):
+            descriptor = self.libc.inotify_add_watch(
+                self.fd, os.fsencode(root), self.MASK)
+            if descriptor >= 0:
+                is_recursive = self.descriptors.get(descriptor, (None, False))[1]
+                self.descriptors[descriptor] = (root, recursive or is_recursive)
+
+    def read(self, timeout=None):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+
+        changes = set()
+        buffer = os.read(self.fd, 64 * 1024)
+        offset = 0
+        while offset < len(buffer):
+            descriptor, mask, _, length = EVENT_HEADER.unpack_from(buffer, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(buffer[offset:offset + length].rstrip(b"\0"))
+            offset += length
+
+            root, recursive = self.descriptors.get(descriptor, ("", False))
+            path = os.path.join(root, name)
+            if mask & IN_ISDIR:
+                if recursive and mask & (IN_CREATE | IN_MOVED_TO) and not self.is_ignored(path):
+                    # New directories are not watched by inotify automatically
+                    self.add(path)
+                continue
+            changes.add(path)
+        return changes
+
+
+def get_watcher(debounce=0.05):
+    "Return an inotify watcher if supported, or a polling watcher"
+    libc_path = ctypes.util.find_library("c")
+    if libc_path:
+        libc = ctypes.CDLL(libc_path, use_errno=True)
+        if hasattr(libc, "inotify_init1"):
+            try:
+                return InotifyWatcher(libc, debounce)
+            except OSError as e:
+                logging.debug("Could not use inotify: %s", e)
+    logging.debug("Inotify is not available, polling for changes")
+    return PollingWatcher(debounce)
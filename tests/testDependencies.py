@@ -0,0 +1,82 @@
+import os
+import unittest
+
+import dependencies
+from renderer import Renderer
+from tests.utils import TestUtilsMixin
+
+class DependenciesTest(unittest.TestCase, TestUtilsMixin):
+    "Ensures that renders record the files they depend on"
+
+    def setUp(self):
+        self.create_directory()
+        self.write("base.html", "{% block body %}{% endblock %}")
+        self.write("nav.html", "nav")
+        self.write("page.html", ('{% extends "base.html" %}'
+                                 '{% block body %}{% include "nav.html" %}{% endblock %}'))
+        self.renderer = Renderer(cwd=self.directory)
+
+    def test_templates(self):
+        "Ensure that extended and included templates are recorded"
+        with dependencies.Dependencies() as recorded:
+            self.assertEqual(self.renderer("page.html"), "nav")
+        self.assertEqual(recorded.files, {
+            os.path.join(self.directory, name)
+            for name in ["base.html", "nav.html", "page.html"]
+        })
+
+    def test_cached_templates(self):
+        "Ensure that templates are recorded even when already compiled"
+        environment = self.renderer.get_environment()
+        self.renderer("page.html", environment)
+        with dependencies.Dependencies() as recorded:
+            self.renderer("page.html", environment)
+        self.assertEqual(len(recorded.files), 3)
+
+    def test_nested(self):
+        "Ensure that every recording dependencies receives the files"
+        with dependencies.Dependencies() as outer:
+            with dependencies.Dependencies() as inner:
+                dependencies.record("a")
+        self.assertEqual(outer.files, inner.files)
+
+    def test_signature_markers(self):
+        "Ensure that markers of resolved values do not change the signature"
+        values = {"output_dir": "out", "__resolved__": frozenset(["a", "b"])}
+        self.assertEqual(dependencies.signature(values),
+                         dependencies.signature({"output_dir": "out"}))
+
+
+class BuildStateTest(unittest.TestCase, TestUtilsMixin):
+    "Ensures that the build state detects outdated outputs"
+
+    def setUp(self):
+        self.create_directory()
+        self.state_path = os.path.join(self.directory, "state.json")
+        self.template = self.write("page.html", "content")
+        self.output = self.write("out.html", "content")
+
+        state = dependencies.BuildState(self.state_path, "signature")
+        state.update(self.output, "page.html", dependencies.Dependencies([self.template]))
+        state.save()
+
+    def test_fresh(self):
+        "Ensure that an output with unchanged dependencies is fresh"
+        state = dependencies.BuildState(self.state_path, "signature")
+        self.assertTrue(state.is_fresh(self.output))
+
+    def test_unknown_output(self):
+        "Ensure that an output never built is not fresh"
+        state = dependencies.BuildState(self.state_path, "signature")
+        self.assertFalse(state.is_fresh(os.path.join(self.directory, "other.html")))
+
+    def test_changed_dependency(self):
+        "Ensure that an output is outdated when a dependency changes"
+        self.write("page.html", "new content")
+        state = dependencies.BuildState(self.state_path, "signature")
+        self.assertFalse(state.is_fresh(self.output))
+
+    def test_changed_signature(self):
+        "Ensure that every output is outdated when parameters change"
+        state = dependencies.BuildState(self.state_path, "other")
+        self.assertFalse(state.is_fresh(self.output))
@@ -1,21 +1,26 @@
+import gc
+import gettext
 import uuid
 import unittest
+from unittest import mock
 import os
+import shutil
 import sys
+import tempfile
+import weakref
 
+import dependencies
+from tests.utils import TestUtilsMixin
 from renderer import Renderer
 from extensions.base import Extension
+from extensions import data
+from extensions.data import DataExtension
+from extensions.files import ContentCache, DirectoryIndex, File, FileExtension
 from extensions.frontmatter import FrontMatterExtension
-from extensions.urls import UrlExtension
-
-class TestUtilsMixin:
-    def create_file(self, file_name, content):
-        "Create a temporary file with content"
-
-        file_instance = open("/tmp/" + file_name, "w+")
-        file_instance.write(content)
-        file_instance.seek(0)
-        return file_instance
+from extensions import urls
+from extensions.urls import UrlExtension, UrlIndex
+from extensions import i18n
+from extensions.i18n import I18nExtension
 
 FILE_CONTENT = """{{1+1}}"""
 
@@ -108,10 +113,368 @@ class FrontmatterExtensionTest(DummyExtensionTest):
         )
         self.assertEqual(values["test_int"], "2")
 
+    def test_compiled_once(self):
+        "Ensures that a front matter is compiled once per environment"
+        config = "test_int = {{baba}}"
+        environment = self.renderer.get_environment()
+        compiled = []
+        from_string = environment.from_string
+        environment.from_string = lambda *args: compiled.append(args) or from_string(*args)
+        for value in [1, 2]:
+            values = self.renderer.parse_lines(config, environment, baba=value)
+            self.assertEqual(values["test_int"], str(value))
+        self.assertEqual(len(compiled), 1)
+
+    def test_compiled_freed(self):
+        "Ensures that compiled front matters do not keep their environment alive"
+        environment = self.renderer.get_environment()
+        self.renderer.parse_lines("test_int = {{baba}}", environment, baba=1)
+        reference = weakref.ref(environment)
+        del environment
+        gc.collect()
+        self.assertIsNone(reference())
+
+    def test_parsing_without_jinja(self):
+        "Ensures that a front matter without Jinja2 tokens is not compiled"
+        environment = self.renderer.get_environment()
+        environment.from_string = None
+        values = self.renderer.parse_lines("name_test = Boom", environment)
+        self.assertEqual(values, {"name_test": "Boom"})
+
     def test_render(self):
         "Ensures that the extension can render a simple jinj2 file"
         self.assertEqual(self.renderer(self.uuid), "Boom")
 
+    def test_strip(self):
+        "Ensures that the front matter block can be stripped from the render"
+        renderer = self.extension_cls(Renderer(cwd="/tmp/"), **{"fm:strip": True})
+        self.assertEqual(renderer(self.uuid), "Boom")
+
+    def test_strip_without_front_matter(self):
+        "Ensures that a short template without front matter is not stripped"
+        file_name = str(uuid.uuid4())
+        self.create_file(file_name, "Hello\nWorld").close()
+        self.addCleanup(os.remove, "/tmp/" + file_name)
+        renderer = self.extension_cls(Renderer(cwd="/tmp/"), **{"fm:strip": True})
+        self.assertEqual(renderer(file_name), "Hello\nWorld")
+
+    def test_single_read(self):
+        "Ensures that the template is read once for its front matter and its render"
+        environment = self.renderer.get_environment()
+        loader = environment.loader.loader
+        reads = []
+        get_source = loader.get_source
+        loader.get_source = lambda *args: reads.append(args) or get_source(*args)
+        self.renderer(self.uuid, environment)
+        self.assertEqual(len(reads), 1)
+
+PAGES_FILE_CONTENT = """{% for p in pages("posts/*.html").order_by("-date").limit(2) %}{{ p.name }}:{{ p.title }} {% endfor %}"""
+
+class FrontmatterPagesTest(unittest.TestCase, TestUtilsMixin):
+    "Tests the front matter index of the pages"
+
+    def setUp(self):
+        self.create_directory()
+        for i in range(3):
+            self.write("posts/%d.html" % i, "<!--\ntitle = Post {{ 1 + %d }}\ndate = 2020-01-0%d\n-->\n" % (i, i))
+        self.write("index.html", PAGES_FILE_CONTENT)
+        self.index = os.path.join(self.directory, "index.json")
+        self.renderer = FrontMatterExtension(Renderer(cwd=self.directory),
+                                             cwd=self.directory, **{"fm:index": self.index})
+
+    def test_pages(self):
+        "Ensures that pages can be queried by their front matter"
+        self.assertEqual(self.renderer("index.html"),
+                         "posts/2.html:Post 3 posts/1.html:Post 2 ")
+
+    def test_index_persisted(self):
+        "Ensures that the index is persisted and that changed pages are read again"
+        self.renderer("index.html")
+        self.assertTrue(os.path.exists(self.index))
+
+        self.write("posts/2.html", "<!--\ntitle = New\ndate = 2020-01-05\n-->\n")
+        renderer = FrontMatterExtension(Renderer(cwd=self.directory),
+                                        cwd=self.directory, **{"fm:index": self.index})
+        self.assertEqual(renderer("index.html"),
+                         "posts/2.html:New posts/1.html:Post 2 ")
+
+XML_DATA = """<feed id="1">
+<title>Feed</title>
+<item sku="a"><name>A</name></item>
+<item sku="b">Text<name>B</name></item>
+</feed>"""
+
+class DataExtensionTest(unittest.TestCase, TestUtilsMixin):
+    "Tests the loading of data files"
+
+    def setUp(self):
+        self.create_directory()
+
+    def load(self, path, **kwargs):
+        kwargs["data:file"] = path
+        return DataExtension(Renderer(), **kwargs).get_context_data()["data"]
+
+    def test_formats(self):
+        "Ensures that json and yaml files are loaded"
+        self.assertEqual(self.load(self.write("data.json", '{"title": "JSON"}')),
+                         {"title": "JSON"})
+        self.assertEqual(self.load(self.write("data.yaml", "title: YAML")),
+                         {"title": "YAML"})
+
+    def test_xml(self):
+        "Ensures that xml files are converted to dicts"
+        path = self.write("data.xml", XML_DATA)
+        self.assertEqual(self.load(path), {"feed": {
+            "@id": "1", "title": "Feed",
+            "item": [{"@sku": "a", "name": "A"}, {"@sku": "b", "name": "B", "#text": "Text"}],
+        }})
+
+    def test_xml_items(self):
+        "Ensures that the elements of xml_item can be iterated over"
+        items = self.load(self.write("data.xml", XML_DATA), **{"data:xml_item": "item"})
+        self.assertEqual([item["@sku"] for item in items], ["a", "b"])
+        self.assertEqual([item["name"] for item in items], ["A", "B"])
+
+    def test_lazy_json(self):
+        "Ensures that lazy json members are parsed on access and arrays streamed"
+        try:
+            import ijson
+        except ImportError:
+            self.skipTest("ijson is not installed")
+        path = self.write("data.json", '{"meta": {"title": "JSON"}, "events": [1, 2]}')
+        lazy = self.load(path, **{"data:lazy": True})
+        self.assertEqual(lazy.meta.title, "JSON")
+        self.assertEqual(lazy["meta"]["title"], "JSON")
+        self.assertEqual(list(lazy.events), [1, 2])
+        self.assertEqual(lazy.keys(), ["meta", "events"])
+        self.assertRaises(KeyError, lambda: lazy["missing"])
+
+        self.assertIs(lazy.keys(), lazy.keys())
+        self.assertIn("events", lazy)
+        self.assertEqual(len(lazy.events), 2)
+        self.assertEqual((lazy.events[0], lazy.events[-1], lazy.events[1:]), (1, 2, [2]))
+        self.assertRaises(IndexError, lambda: lazy.events[2])
+
+    def test_sources(self):
+        "Ensures that named data sources are loaded on access or prefetched"
+        sources = {
+            "data:products": self.write("products.yaml", "- sku: a"),
+            "data:prices": self.write("prices.json", '{"a": 10}'),
+            "data:file": self.write("data.json", '{"title": "JSON"}'),
+        }
+        for threads in (0, 2):
+            data = DataExtension(Renderer(), **{"data:threads": threads}, **sources) \
+                .get_context_data()["data"]
+            self.assertEqual(sorted(data.keys()), ["prices", "products"])
+            self.assertEqual(data.products, [{"sku": "a"}])
+            self.assertEqual(data["prices"], {"a": 10})
+            self.assertEqual(data.title, "JSON")
+
+    def test_sources_list_fallback(self):
+        "Ensures that names missing from a fallback list are missing attributes"
+        sources = {"data:file": self.write("data.json", "[1]"),
+                   "data:products": self.write("products.yaml", "- sku: a")}
+        data = DataExtension(Renderer(), **sources).get_context_data()["data"]
+        self.assertRaises(KeyError, lambda: data["title"])
+        self.assertFalse(hasattr(data, "title"))
+
+    def test_sources_on_access(self):
+        "Ensures that data sources are only loaded when they are used"
+        sources = {"data:products": self.write("products.yaml", "- sku: a"),
+                   "data:prices": self.write("prices.json", '{"a": 10}')}
+        data = DataExtension(Renderer(), **sources).get_context_data()["data"]
+        self.assertEqual(data.prices, {"a": 10})
+        self.assertEqual(list(data.values), ["prices"])
+
+    def test_sqlite(self):
+        "Ensures that SQLite databases are queried read only and results memoized"
+        import sqlite3
+        path = os.path.join(self.directory, "catalog.db")
+        with sqlite3.connect(path) as connection:
+            connection.execute("CREATE TABLE product (sku TEXT, price INTEGER)")
+            connection.executemany("INSERT INTO product VALUES (?, ?)", [("a", 1), ("b", 2)])
+        connection.close()
+
+        catalog = self.load(path)
+        rows = catalog.query("SELECT * FROM product WHERE sku = ?", "b")
+        self.assertEqual([row["price"] for row in rows], [2])
+        self.assertEqual(len(catalog.results), 1)
+        self.assertEqual(catalog.query("SELECT sku FROM product").first()["sku"], "a")
+        self.assertRaises(sqlite3.OperationalError, lambda: list(
+            catalog.query("INSERT INTO product VALUES ('c', 3)")))
+
+    def test_csv(self):
+        "Ensures that csv rows are streamed or stored in typed columns"
+        path = self.write("data.csv", "sku,stock,price,color\na,1,1.5,red\nb,2,2,red\nc,3,3,blue\n")
+        rows = self.load(path)
+        self.assertEqual([row["sku"] for row in rows], ["a", "b", "c"])
+
+        table = self.load(path, **{"data:columnar": True})
+        self.assertEqual(len(table), 3)
+        self.assertEqual(table[1].stock, 2)
+        self.assertEqual(table[0]["price"], 1.5)
+        self.assertEqual(list(table.column("color")), ["red", "red", "blue"])
+        self.assertEqual(table.column("color").values, ["red", "blue"])
+        self.assertEqual(table.column("stock").typecode, "q")
+        self.assertEqual([row.sku for row in table], ["a", "b", "c"])
+
+    def test_csv_missing(self):
+        "Ensures that blank lines, short rows and leading zeros are read as when streamed"
+        path = self.write("data.csv", "zip,stock,name\n00123,1,a\n\n04567,,b\n08901\n")
+        rows = [dict(row) for row in self.load(path)]
+        table = self.load(path, **{"data:columnar": True})
+        self.assertEqual([row["zip"] for row in table], ["00123", "04567", "08901"])
+        self.assertEqual([row["stock"] for row in table], [1, None, None])
+        self.assertEqual([row["name"] for row in table], [row["name"] for row in rows])
+
+    def test_index(self):
+        "Ensures that indexes are built once per build and can be declared"
+        sources = {"data:products": self.write("products.yaml", "- sku: a\n- sku: b"),
+                   "data:indexes": ["products.sku"]}
+        ctxt = DataExtension(Renderer(), **sources).get_context_data()
+        index = ctxt["index"](ctxt["data"].products, "sku")
+        self.assertEqual(index.get("b"), {"sku": "b"})
+        self.assertIs(ctxt["index"](ctxt["data"].products, "sku"), index)
+
+        sources["data:indexes"] = ["missing.sku"]
+        self.assertRaises(ValueError, DataExtension(Renderer(), **sources).get_context_data)
+
+    def test_index_cache(self):
+        "Ensures that declared indexes are cached with the data"
+        sources = {"data:products": self.write("products.yaml", "- sku: a\n- sku: b"),
+                   "data:indexes": ["products.sku"],
+                   "data:cache": os.path.join(self.directory, "cache")}
+        DataExtension(Renderer(), **sources).get_context_data()
+
+        with mock.patch.object(data, "Index", side_effect=AssertionError):
+            ctxt = DataExtension(Renderer(), **sources).get_context_data()
+            index = ctxt["index"](ctxt["data"].products, "sku")
+        self.assertIs(index.get("b"), ctxt["data"].products[1])
+
+    def test_cache(self):
+        "Ensures that parsed data is cached until the file changes"
+        cache = os.path.join(self.directory, "cache")
+        path = self.write("data.json", '{"title": "JSON"}')
+        self.assertEqual(self.load(path, **{"data:cache": cache}), {"title": "JSON"})
+
+        loaders = dict(data.LOADERS)
+        data.LOADERS[".json"] = lambda path: self.fail("Data parsed again")
+        try:
+            self.assertEqual(self.load(path, **{"data:cache": cache}), {"title": "JSON"})
+        finally:
+            data.LOADERS.update(loaders)
+
+        self.write("data.json", '{"title": "Changed"}')
+        self.assertEqual(self.load(path, **{"data:cache": cache}), {"title": "Changed"})
+
+FILES_TEMPLATE = """{% for post in files("**/*.yml") %}{{ post.title }} {% endfor %}"""
+
+class FilesExtensionTest(unittest.TestCase, TestUtilsMixin):
+    "Tests the directory index of the files extension"
+
+    def setUp(self):
+        self.create_directory()
+        self.write("posts/first.yml", "title: First")
+        self.write("posts/2020/second.yml", "title: Second")
+        self.write("index.html", FILES_TEMPLATE)
+
+    def test_recursive_pattern(self):
+        "Ensures that ** matches files in every sub directory"
+        renderer = FileExtension(Renderer(cwd=self.directory), cwd=self.directory)
+        self.assertEqual(renderer("index.html"), "Second First ")
+
+    def test_same_as_glob(self):
+        "Ensures that the index matches the same paths as glob"
+        from glob import glob
+        index = DirectoryIndex(self.directory)
+        for pattern in ("*", "**", "posts/*", "**/*.yml", "posts/**", "*/2020/*"):
+            self.assertEqual(
+                [os.path.join(self.directory, path) for path in index.glob(pattern)],
+                sorted(glob(os.path.join(self.directory, pattern), recursive=True)))
+
+    def test_outside_pattern(self):
+        "Ensures that patterns leaving the directory are resolved by glob"
+        self.write("shared/x.yml", "title: Shared")
+        site = os.path.join(self.directory, "posts")
+        renderer = FileExtension(Renderer(cwd=site), cwd=site)
+        get_files = renderer.get_context_data()["files"]
+        self.assertEqual([f.path for f in get_files("../shared/*.yml")],
+                         [os.path.join(site, "../shared/x.yml")])
+        self.assertEqual([f.title for f in get_files(os.path.join(self.directory, "shared/*"))],
+                         ["Shared"])
+
+    def test_recorded_pattern(self):
+        "Ensures that patterns are recorded normalized, as glob matches the index"
+        renderer = FileExtension(Renderer(cwd=self.directory), cwd=self.directory)
+        with dependencies.Dependencies() as recorded:
+            renderer.get_context_data()["files"]("./posts/*.yml")
+        self.assertEqual(recorded.globs, {
+            os.path.join(self.directory, "posts/*.yml"):
+                [os.path.join(self.directory, "posts/first.yml")]})
+
+    def test_refresh(self):
+        "Ensures that a refresh picks up new and changed files"
+        renderer = FileExtension(Renderer(cwd=self.directory), cwd=self.directory)
+        get_files = renderer.get_context_data()["files"]
+        self.assertEqual([f.title for f in get_files("**/*.yml")], ["Second", "First"])
+
+        changes = {self.write("posts/2021/third.yml", "title: Third"),
+                   self.write("posts/first.yml", "title: Changed")}
+        self.assertEqual(len(get_files("**/*.yml")), 2)
+        renderer.refresh(changes)
+        self.assertEqual([f.title for f in get_files("**/*.yml")],
+                         ["Second", "Third", "Changed"])
+
+    def test_shared_files(self):
+        "Ensures that files are parsed once for every call"
+        renderer = FileExtension(Renderer(cwd=self.directory), cwd=self.directory)
+        get_files = renderer.get_context_data()["files"]
+        first = get_files("posts/*.yml")[0]
+        self.assertEqual(first.title, "First")
+        self.assertIs(get_files("**/first.yml")[0], first)
+
+    def test_content_keys(self):
+        "Ensures that keys of the content are not hidden by the metadata"
+        self.write("posts/widget.yml", "name: Widget\nsize: XL\nmtime: never")
+        renderer = FileExtension(Renderer(cwd=self.directory), cwd=self.directory)
+        widget = renderer.get_context_data()["files"]("posts/widget.yml")[0]
+        self.assertEqual((widget.name, widget.size, widget["mtime"]), ("Widget", "XL", "never"))
+        self.assertEqual(widget.file_name, "posts/widget.yml")
+
+    def test_lazy_query(self):
+        "Ensures that only the files returned are parsed when sorting on metadata"
+        renderer = FileExtension(Renderer(cwd=self.directory), cwd=self.directory)
+        files = renderer.get_context_data()["files"]("**/*.yml")
+        latest = files.order_by("-file_name").limit(1)
+        self.assertEqual([f.title for f in latest], ["First"])
+        self.assertEqual([f.content is not None for f in files], [False, True])
+        self.assertEqual(files.where(title="Second").count(), 1)
+
+    def test_memory_budget(self):
+        "Ensures that contents over the budget are evicted and parsed again"
+        contents = ContentCache(budget=15)
+        first = File(os.path.join(self.directory, "posts/first.yml"), contents=contents)
+        second = File(os.path.join(self.directory, "posts/2020/second.yml"), contents=contents)
+        self.assertEqual(first.title, "First")
+        self.assertEqual(second.title, "Second")
+        self.assertIsNone(first.content)
+        self.assertEqual(contents.used, second.file_size)
+        self.assertEqual(first.title, "First")
+        self.assertFalse(hasattr(first, "__dict__"))
+
+    def test_cache(self):
+        "Ensures that parsed files are cached and read again when they change"
+        cache = os.path.join(self.directory, "cache")
+        renderer = FileExtension(Renderer(cwd=self.directory), cwd=self.directory,
+                                 **{"files:cache": cache})
+        self.assertEqual(renderer("index.html"), "Second First ")
+        self.assertEqual(len(os.listdir(cache)), 2)
+
+        self.write("posts/first.yml", "title: Changed")
+        renderer = FileExtension(Renderer(cwd=self.directory), cwd=self.directory,
+                                 **{"files:cache": cache})
+        self.assertEqual(renderer("index.html"), "Second Changed ")
+
 URL_FILE_CONTENT = """
 {{url("contact")}}
 {{url("home")}}
@@ -202,3 +565,198 @@ class UrlExtensionTest(unittest.TestCase, TestUtilsMixin):
         os.remove("/tmp/"+self.uuid)
         os.remove("/tmp/"+self.python_uuid)
         sys.path = self.previous_path
+
+
+class UrlIndexTest(unittest.TestCase):
+    """Tests the lookups of the compiled urls"""
+
+    def setUp(self):
+        self.index = UrlIndex([
+            ("contact", {}, "contact"),
+            ("post", {"date": "2012-05-06"}, "blog/2012-05-06"),
+            ("post", {"date": "2012-05-06", "lang": "fr"}, "fr/blog/2012-05-06"),
+            ("post", {"default": True}, "blog/"),
+            ("tag", {"tags": ["a"]}, "tags/a"),
+        ])
+
+    def test_first_match(self):
+        "Ensure that the first url matching in the list is returned"
+        self.assertEqual(self.index.get("post", {"date": "2012-05-06", "lang": "fr"}),
+                         "blog/2012-05-06")
+        self.assertEqual(self.index.get("contact", {"lang": "fr"}), "contact")
+
+    def test_default(self):
+        "Ensure that the default url is returned when nothing matches"
+        self.assertEqual(self.index.get("post", {"date": "2013-01-01"}), "blog/")
+        self.assertIsNone(self.index.get("post", {"default": False}))
+        self.assertIsNone(self.index.get("missing", {}))
+
+    def test_unhashable(self):
+        "Ensure that urls with unhashable arguments still match"
+        self.assertEqual(self.index.get("tag", {"tags": ["a"]}), "tags/a")
+        self.assertIsNone(self.index.get("tag", {"tags": ["b"]}))
+
+class CompiledUrlsTest(unittest.TestCase):
+    """Tests the validation and the loading of compiled urls"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.module = "compiled_%s" % uuid.uuid4().hex
+        self.source = os.path.join(self.directory, self.module + ".py")
+        with open(self.source, "w") as f:
+            f.write(URL_PYTHON_FILE_CONTENT)
+
+    def test_validate(self):
+        "Ensure that malformed and duplicated urls are errors"
+        errors, warnings = urls.validate_urls([
+            ("post", {"date": "1"}, "blog/1"),
+            ("post", {"date": "1"}, "blog/2"),
+            ("tag", {"tag": "a"}, "tags/a"),
+            ("tag", {"default": True}, "tags/"),
+            ("contact", "contact"),
+        ])
+        self.assertEqual(len(errors), 2)
+        self.assertEqual(len(warnings), 1)
+
+    def test_validate_shadowed(self):
+        "Ensure that urls after an url matching a subset of their args are errors"
+        errors, warnings = urls.validate_urls([
+            ("post", {}, "blog/"),
+            ("post", {"default": True}, "blog/default"),
+            ("tag", {"tag": "a"}, "tags/a"),
+            ("tag", {"tag": "a", "page": 2}, "tags/a/2"),
+            ("tag", {"tag": "b"}, "tags/b"),
+        ])
+        self.assertEqual(len(errors), 2)
+        self.assertIn("URLS[1]", errors[0])
+        self.assertIn("URLS[3]", errors[1])
+
+    def test_load_compiled(self):
+        "Ensure that fresh compiled urls are loaded without importing the urls"
+        compiled = urls.get_compiled_path(self.source)
+        url_list = [("contact", {}, "compiled")]
+        urls.dump_compiled(url_list, self.source, compiled)
+
+        renderer = UrlExtension(Renderer(), **{"url:urls": self.source})
+        self.assertEqual(renderer.get_url("contact"), "/compiled")
+        self.assertNotIn(self.module, sys.modules)
+
+        # Compiled urls of a python file that changed are ignored
+        with open(self.source, "a") as f:
+            f.write("\n# Changed\n")
+        self.assertIsNone(urls.load_compiled(self.source, compiled))
+
+    def test_compiled_version(self):
+        "Ensure that urls compiled by another version are ignored"
+        compiled = urls.get_compiled_path(self.source)
+        urls.get_compiled_cache(compiled).dump(self.source, ([], None), "urls:0")
+        self.assertIsNone(urls.load_compiled(self.source, compiled))
+        urls.dump_compiled([], self.source, compiled)
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         sorted([self.module + ".py", self.module + ".pickle"]))
+        self.assertIsNotNone(urls.load_compiled(self.source, compiled))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+I18N_FILE_CONTENT = """{{ _("Hello") }} {{ lang }}"""
+
+class I18nExtensionTest(unittest.TestCase, TestUtilsMixin):
+    """Tests the i18n extension"""
+    extension_cls = I18nExtension
+    template = I18N_FILE_CONTENT
+
+    def create_catalog(self, language, translation):
+        "Compile a catalog translating Hello for a language"
+        from babel.messages.catalog import Catalog
+        from babel.messages.mofile import write_mo
+
+        catalog = Catalog(locale=language)
+        catalog.add("Hello", translation)
+        directory = os.path.join(self.locale_dir, language, "LC_MESSAGES")
+        os.makedirs(directory)
+        with open(os.path.join(directory, "messages.mo"), "wb") as mo_file:
+            write_mo(mo_file, catalog)
+
+    def setUp(self):
+        self.locale_dir = tempfile.mkdtemp()
+        self.create_catalog("fr", "Bonjour")
+        self.create_catalog("de", "Hallo")
+
+        self.uuid = str(uuid.uuid4())
+        self.file = self.create_file(self.uuid, self.template)
+
+    def get_renderer(self, **kwargs):
+        kwargs["i18n:locale_dir"] = self.locale_dir
+        return self.extension_cls(Renderer(cwd="/tmp/"), **kwargs)
+
+    def test_render(self):
+        "Ensures that a file is rendered in the language"
+        renderer = self.get_renderer(**{"i18n:language": "fr"})
+        self.assertEqual(renderer(self.uuid), "Bonjour fr")
+
+    def test_no_variants(self):
+        "Ensures that there are no variants with a single language"
+        renderer = self.get_renderer(**{"i18n:language": "fr"})
+        self.assertEqual(renderer.get_variants(), {})
+
+    def test_variants(self):
+        "Ensures that every language is rendered with the same environment"
+        renderer = self.get_renderer(**{"i18n:languages": "fr,de"})
+        variants = renderer.get_variants()
+        self.assertEqual(list(variants), ["fr", "de"])
+
+        environment = renderer.get_environment()
+        context_data = renderer.get_context_data()
+        renders = [renderer(self.uuid, environment, variant(dict(context_data)))
+                   for variant in variants.values()]
+        self.assertEqual(renders, ["Bonjour fr", "Hallo de"])
+
+    def test_variant_dependencies(self):
+        "Ensures that every render of a language depends on its catalog"
+        renderer = self.get_renderer(**{"i18n:languages": "fr,de"})
+        variants = renderer.get_variants()
+        for language in ["fr", "de"]:
+            for _ in range(2):
+                with dependencies.Dependencies() as page_dependencies:
+                    variants[language]({})
+                path = os.path.join(self.locale_dir, language, "LC_MESSAGES", "messages.mo")
+                self.assertEqual(page_dependencies.files, {os.path.abspath(path)})
+
+    def test_translations_loaded_once(self):
+        "Ensures that a catalog is loaded once per process"
+        renderer = self.get_renderer(**{"i18n:language": "fr"})
+        self.assertIs(renderer.get_translations(), renderer.get_translations())
+
+    def test_catalog_cache(self):
+        "Ensures that catalogs can be loaded from the catalog cache"
+        cache_dir = os.path.join(self.locale_dir, "cache")
+        renderer = self.get_renderer(**{"i18n:language": "fr",
+                                        "i18n:catalog_cache": cache_dir})
+        self.assertEqual(renderer(self.uuid), "Bonjour fr")
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+        i18n.CATALOGS.clear()
+        renderer = self.get_renderer(**{"i18n:language": "fr",
+                                        "i18n:catalog_cache": cache_dir})
+        from babel.support import Translations
+        with mock.patch.object(Translations, "load", side_effect=AssertionError):
+            self.assertEqual(renderer(self.uuid), "Bonjour fr")
+
+    def test_catalog_cache_plural(self):
+        "Ensures that a cached catalog without Plural-Forms uses the default plural"
+        from babel.support import Translations
+        path = os.path.join(self.locale_dir, "messages.catalog")
+        translations = Translations()
+        translations._catalog = {("page", 0): "une page", ("page", 1): "des pages"}
+        i18n.dump_cached_catalog(translations, path)
+
+        translations = i18n.load_cached_catalog(gettext.GNUTranslations, path)
+        self.assertEqual(translations.ngettext("page", "pages", 1), "une page")
+        self.assertEqual(translations.ngettext("page", "pages", 2), "des pages")
+
+    def tearDown(self):
+        self.file.close()
+        os.remove("/tmp/"+self.uuid)
+        shutil.rmtree(self.locale_dir)
+        i18n.CATALOGS.clear()
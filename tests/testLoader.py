@@ -0,0 +1,129 @@
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import dependencies
+from loader import Loader
+from renderer import Renderer
+
+class BatchFilesTest(unittest.TestCase):
+    "Ensures that the loader expands the files to render in batch mode"
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.directory, "posts"))
+        for name in ["index.html", "posts/a.html", "posts/b.html"]:
+            with open(os.path.join(self.directory, name), "w") as f:
+                f.write(name)
+        self.loader = Loader()
+
+    def test_single_file(self):
+        "Ensure that a plain file path is kept as is"
+        files = self.loader.get_files(file=["index.html"], cwd=self.directory)
+        self.assertEqual(files, ["index.html"])
+
+    def test_glob(self):
+        "Ensure that glob patterns are resolved relatively to cwd"
+        files = self.loader.get_files(file=["posts/*.html"], cwd=self.directory)
+        self.assertEqual(files, ["posts/a.html", "posts/b.html"])
+
+    def test_recursive_glob(self):
+        "Ensure that recursive glob patterns are supported"
+        files = self.loader.get_files(file=["**/*.html"], cwd=self.directory)
+        self.assertEqual(sorted(files),
+                         ["index.html", "posts/a.html", "posts/b.html"])
+
+    def test_stdin_read_once(self):
+        "Ensure that files read from stdin are kept for the next expansions"
+        stdin, sys.stdin = sys.stdin, io.StringIO("index.html\n")
+        try:
+            self.loader.get_files(file=["-"], cwd=self.directory)
+            files = self.loader.get_files(file=["-", "posts/*.html"], cwd=self.directory)
+        finally:
+            sys.stdin = stdin
+        self.assertEqual(files, ["index.html", "posts/a.html", "posts/b.html"])
+
+    def test_watched_directories(self):
+        "Ensure that only cwd and recursive patterns are watched recursively"
+        data = os.path.join(self.directory, "data", "site.json")
+        prepared = (None, None, dependencies.Dependencies([data], {
+            os.path.join(self.directory, "posts", "*.html"): [],
+            os.path.join(self.directory, "pages", "**", "*.html"): []}))
+        directories = self.loader.get_watched_directories({}, prepared, cwd=self.directory)
+        self.assertEqual(directories, {
+            self.directory: True,
+            os.path.join(self.directory, "data"): False,
+            os.path.join(self.directory, "posts"): False,
+            os.path.join(self.directory, "pages"): True})
+
+    def test_ignored_paths(self):
+        "Ensure that outputs, the build state and output_dir are ignored"
+        output = os.path.join(self.directory, "out", "index.html")
+        ignored = self.loader.get_ignored_paths(
+            {("index.html", None): output}, cwd=self.directory,
+            output_dir=os.path.join(self.directory, "out"), build_state="state.json")
+        self.assertEqual(ignored, {output, "state.json", os.path.join(self.directory, "out")})
+
+    def test_batch_output(self):
+        "Ensure that a batch render is saved under output_dir"
+        output = self.loader.get_batch_output(
+            "posts/a.html", cwd=self.directory, output_dir="/tmp/out")
+        self.assertEqual(output, "/tmp/out/posts/a.html")
+
+    def test_batch_output_overwrite(self):
+        "Ensure that a batch render never overwrites its template"
+        with self.assertRaises(ValueError):
+            self.loader.get_batch_output(
+                "posts/a.html", cwd=self.directory, output_dir=self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+class ParallelRenderTest(unittest.TestCase):
+    "Ensures that the loader can render files with multiple processes"
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.files = ["%d.html" % i for i in range(10)]
+        for name in self.files:
+            with open(os.path.join(self.directory, name), "w") as f:
+                f.write("{{ %d * 2 }}" % int(name.split(".")[0]))
+        self.renderer = Renderer(cwd=self.directory)
+
+    def test_order(self):
+        "Ensure that renders are returned in the same order as the files"
+        loader = Loader()
+        renders = list(loader.render(self.renderer, Loader.get_targets(self.files, {}),
+                                     loader.prepare(self.renderer), jobs=3))
+        self.assertEqual([(target[0], rendered) for target, rendered, _ in renders],
+                         [(name, str(i * 2)) for i, name in enumerate(self.files)])
+
+    def test_error(self):
+        "Ensure that an error in a worker is raised by the parent"
+        with open(os.path.join(self.directory, "5.html"), "w") as f:
+            f.write("{{ 1 / 0 }}")
+        loader = Loader()
+        with self.assertRaises(ZeroDivisionError):
+            list(loader.render(self.renderer, Loader.get_targets(self.files, {}),
+                               loader.prepare(self.renderer), jobs=3))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+class StartupTest(unittest.TestCase):
+    "Ensures that the loader starts without importing what it does not use"
+
+    def test_lazy_imports(self):
+        "Ensures that jinja2 and colorlog are not imported with the loader"
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        output = subprocess.check_output([sys.executable, "-c", (
+            "import sys, stake.loader; "
+            "print(sorted(m for m in ('jinja2', 'colorlog', 'multiprocessing') "
+            "if m in sys.modules))")], cwd=root, stdin=subprocess.DEVNULL)
+        self.assertEqual(output.strip(), b"[]")
@@ -179,6 +179,73 @@ class ReplaceInitTest(unittest.TestCase):
         self.assertEqual(fn(), 2)
 
 
+class CompiledParametersTest(unittest.TestCase):
+    "Ensures that stacked parameters are parsed in a single pass"
+
+    def setUp(self):
+        params.ARGPARSE_PARAMETERS = set()
+
+    def test_single_wrapper(self):
+        "Ensure that stacked decorators share a single wrapper"
+        fn = params.integer("test:a")(temp_fn)
+        stacked = params.string("test:value", default="b")(fn)
+        self.assertIs(stacked, fn)
+        self.assertEqual([p.name for p in fn.parameters], ["test:value", "test:a"])
+        self.assertEqual(fn(**{"test:a": "1"}), "b")
+
+    def test_class_not_shared(self):
+        "Ensure that a sub class does not add parameters to its parent"
+        parent = params.string("value", default="parent")(
+            type('Parent', (TempParentClass,), {}))
+        child = params.string("original", default="child")(type('Child', (parent,), {}))
+        self.assertEqual(len(parent.__init__.parameters), 1)
+        self.assertEqual(child().original, "child")
+        self.assertEqual(child().value, "parent")
+
+    def test_resolve(self):
+        "Ensure that resolved values are cast once and immutable"
+        casts = []
+        class CountedParameter(params.Parameter):
+            def convert(self, value):
+                casts.append(value)
+                return int(value)
+
+        fn = CountedParameter("test:value")(temp_fn)
+        values = params.resolve({"test:value": "1"})
+        self.assertEqual(fn(**values), 1)
+        self.assertEqual(fn(**values), 1)
+        self.assertEqual(casts, ["1"])
+        with self.assertRaises(TypeError):
+            values["test:value"] = 2
+
+    def test_resolve_order(self):
+        "Ensure that the first parameter declared with a name is used"
+        for index in range(20):
+            params.ARGPARSE_PARAMETERS = set()
+            params.StringParameter("test%d" % index, default="first")
+            params.IntegerParameter("test%d" % index, default="2")
+            self.assertEqual(params.resolve({})["test%d" % index], "first")
+
+    def test_resolve_namespaces(self):
+        "Ensure that the values of each namespace are indexed once"
+        site = params.NamespaceParameter("site")
+        values = params.resolve({"site:title": "a", "site:nav:home": "b", "other": "c"})
+        self.assertEqual(values[params.NAMESPACES],
+                         {"site": {"title": "a"}, "site.nav": {"home": "b"}})
+        self.assertEqual(values["site"], {"title": "a"})
+        indexed = {"site:title": "a", params.NAMESPACES: {"site": {"title": "b"}}}
+        self.assertEqual(site.resolve(indexed), {"title": "b"})
+
+    def test_incremental_arguments(self):
+        "Ensure that parameters are added once and their defaults updated"
+        parser = argparse.ArgumentParser()
+        params.StringParameter("test")
+        params.add_arguments(parser)
+        params.StringParameter("other", default="a")
+        params.add_arguments(parser, {"test": "default"})
+        self.assertEqual(vars(parser.parse_args([])), {"test": "default", "other": "a"})
+
+
 class ArgParseTest(unittest.TestCase):
     "Ensures that argparsing works correctly with parameters"
 
@@ -0,0 +1,120 @@
+import unittest
+
+from query import AttributeAccess, Index, Query
+
+ITEMS = [
+    {"name": "c", "date": 3, "tag": "a"},
+    {"name": "a", "date": 1, "tag": "b"},
+    {"name": "b", "date": 2, "tag": "a"},
+    {"name": "d", "date": None, "tag": "b"},
+]
+
+class QueryTest(unittest.TestCase):
+    "Ensures that queries filter, sort and slice items"
+
+    def setUp(self):
+        self.query = Query(ITEMS)
+
+    def names(self, query):
+        return [item["name"] for item in query]
+
+    def test_iterate(self):
+        "Ensure that a query without conditions returns every item"
+        self.assertEqual(self.names(self.query), ["c", "a", "b", "d"])
+        self.assertEqual(len(self.query), 4)
+
+    def test_where(self):
+        "Ensure that items can be filtered by value"
+        self.assertEqual(self.names(self.query.where(tag="a")), ["c", "b"])
+
+    def test_where_lookup(self):
+        "Ensure that items can be filtered with lookups"
+        self.assertEqual(self.names(self.query.where(date__gte=2)), ["c", "b"])
+        self.assertEqual(self.names(self.query.where(name__in=["a", "d"])), ["a", "d"])
+
+    def test_where_predicate(self):
+        "Ensure that items can be filtered with a function"
+        query = self.query.where(lambda item: item["name"] > "b")
+        self.assertEqual(self.names(query), ["c", "d"])
+
+    def test_order_by(self):
+        "Ensure that items are sorted with missing values first"
+        self.assertEqual(self.names(self.query.order_by("date")), ["d", "a", "b", "c"])
+        self.assertEqual(self.names(self.query.order_by("-date")), ["c", "b", "a", "d"])
+
+    def test_order_by_multiple(self):
+        "Ensure that items can be sorted by multiple keys"
+        query = self.query.order_by("tag", "-name")
+        self.assertEqual(self.names(query), ["c", "b", "d", "a"])
+
+    def test_limit_offset(self):
+        "Ensure that limit and offset slice the sorted items"
+        query = self.query.order_by("name").offset(1).limit(2)
+        self.assertEqual(self.names(query), ["b", "c"])
+
+    def test_slice(self):
+        "Ensure that slicing a query returns a query"
+        query = self.query.order_by("name")[1:3]
+        self.assertIsInstance(query, Query)
+        self.assertEqual(self.names(query), ["b", "c"])
+        self.assertEqual(self.query.order_by("name")[0]["name"], "a")
+
+    def test_page(self):
+        "Ensure that items can be paginated"
+        query = self.query.order_by("name")
+        self.assertEqual(self.names(query.page(2, 3)), ["d"])
+        self.assertEqual(query.pages(3), 2)
+
+    def test_not_evaluated(self):
+        "Ensure that items are only read when the query is evaluated"
+        reads = []
+        query = Query(ITEMS, lambda item, key: reads.append(key) or item[key])
+        query = query.where(tag="a").order_by("date")
+        self.assertEqual(reads, [])
+        query.first()
+        self.assertNotEqual(reads, [])
+
+
+class AttributeAccessTest(unittest.TestCase):
+    "Ensures that items are accessed as attributes"
+
+    class Item(AttributeAccess):
+        def __getitem__(self, key):
+            if key == "broken":
+                raise TypeError("bug in a lookup")
+            return {"title": "Title"}[key]
+
+    def test_attributes(self):
+        "Ensure that missing items are missing attributes and other errors are raised"
+        item = self.Item()
+        self.assertEqual(item.title, "Title")
+        self.assertFalse(hasattr(item, "missing"))
+        self.assertRaises(TypeError, lambda: item.broken)
+
+
+class IndexTest(unittest.TestCase):
+    "Tests the lookups in an index"
+
+    def setUp(self):
+        self.index = Index(ITEMS, "tag")
+
+    def test_get(self):
+        "Ensure that get returns the first item with a value"
+        self.assertEqual(self.index.get("a")["name"], "c")
+        self.assertEqual(self.index["b"]["name"], "a")
+        self.assertIsNone(self.index.get("c"))
+        self.assertRaises(KeyError, lambda: self.index["c"])
+
+    def test_all(self):
+        "Ensure that all returns every item with a value"
+        self.assertEqual([item["name"] for item in self.index.all("b")], ["a", "d"])
+        self.assertEqual(self.index.all("c"), [])
+        self.assertEqual(sorted(self.index), ["a", "b"])
+
+    def test_unhashable(self):
+        "Ensure that items with an unhashable value are not indexed"
+        index = Index([{"tags": ["a"]}, {"tags": {"a": 1}}, {"tags": "a"}], "tags")
+        self.assertEqual(list(index), ["a"])
+        self.assertEqual(index.all(["a"]), [])
+        self.assertIsNone(index.get({"a": 1}))
+        self.assertNotIn(["a"], index)
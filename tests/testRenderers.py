@@ -1,6 +1,8 @@
 import uuid
 import unittest
 import os
+import shutil
+import tempfile
 
 from renderer import Renderer
 
@@ -38,6 +40,37 @@ class RendererTest(unittest.TestCase):
         self.file.close()
         os.remove("/tmp/"+self.uuid)
 
+class BytecodeCacheTest(unittest.TestCase):
+    "Tests linked to the persistent bytecode cache"
+    def setUp(self):
+        self.uuid = str(uuid.uuid4())
+        with open("/tmp/"+self.uuid, "w") as f:
+            f.write(FILE_CONTENT)
+        self.cache_dir = tempfile.mkdtemp()
+
+    def test_no_cache(self):
+        "Test that there is no bytecode cache by default"
+        renderer = Renderer(cwd="/tmp/")
+        self.assertIsNone(renderer.get_environment().bytecode_cache)
+
+    def test_cache_is_written(self):
+        "Test that compiled templates are stored in the cache directory"
+        renderer = Renderer(cwd="/tmp/", bytecode_cache=self.cache_dir)
+        self.assertEqual(renderer(self.uuid), "2")
+        cached = [f for _, _, files in os.walk(self.cache_dir) for f in files]
+        self.assertEqual(len(cached), 1)
+        self.assertTrue(cached[0].endswith(".cache"))
+
+    def test_cache_is_reused(self):
+        "Test that a new renderer can render from the cache"
+        Renderer(cwd="/tmp/", bytecode_cache=self.cache_dir)(self.uuid)
+        renderer = Renderer(cwd="/tmp/", bytecode_cache=self.cache_dir)
+        self.assertEqual(renderer(self.uuid), "2")
+
+    def tearDown(self):
+        os.remove("/tmp/"+self.uuid)
+        shutil.rmtree(self.cache_dir)
+
 class SiteVariableLoadingTest(unittest.TestCase):
     "Tests linked to site variable loading"
     def test_site_variables(self):
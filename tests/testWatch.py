@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from watch import PollingWatcher, Watcher, get_watcher
+
+class WatcherTest(unittest.TestCase):
+    "Ensures that watchers detect changes in watched directories"
+
+    def get_watcher(self):
+        return PollingWatcher(debounce=0.01, interval=0.01)
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.directory, "sub"))
+        self.path = os.path.join(self.directory, "sub", "page.html")
+        with open(self.path, "w") as f:
+            f.write("content")
+        self.watcher = self.get_watcher()
+        self.watcher.watch([self.directory])
+
+    def test_abstract(self):
+        "Ensure that the base watcher can not be used without add and read"
+        with self.assertRaises(TypeError):
+            Watcher()
+
+    def test_no_change(self):
+        "Ensure that nothing is returned when nothing changed"
+        self.assertEqual(self.watcher.read(0.05), set())
+
+    def test_change(self):
+        "Ensure that a modified file is returned"
+        with open(self.path, "w") as f:
+            f.write("new content")
+        self.assertIn(self.path, self.watcher.wait())
+
+    def test_new_file(self):
+        "Ensure that a created file is returned"
+        path = os.path.join(self.directory, "new.html")
+        with open(path, "w") as f:
+            f.write("content")
+        self.assertIn(path, self.watcher.wait())
+
+    def test_ignored(self):
+        "Ensure that changes to ignored paths and their temporary files are skipped"
+        ignored = os.path.join(self.directory, "state.json")
+        self.watcher.ignore([ignored])
+        for path in [ignored, ignored + ".12.tmp"]:
+            with open(path, "w") as f:
+                f.write("content")
+        with open(self.path, "w") as f:
+            f.write("new content")
+        self.assertEqual(self.watcher.wait(), {self.path})
+
+    def test_not_recursive(self):
+        "Ensure that sub directories of a directory watched alone are skipped"
+        watcher = self.get_watcher()
+        watcher.watch([self.directory], recursive=False)
+        with open(self.path, "w") as f:
+            f.write("new content")
+        path = os.path.join(self.directory, "new.html")
+        with open(path, "w") as f:
+            f.write("content")
+        self.assertEqual(watcher.wait(), {path})
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+class DefaultWatcherTest(WatcherTest):
+    "Run the watcher tests with the default watcher of the platform"
+
+    def get_watcher(self):
+        return get_watcher(debounce=0.01)
@@ -0,0 +1,25 @@
+import os
+import shutil
+import tempfile
+
+class TestUtilsMixin:
+    def create_file(self, file_name, content):
+        "Create a temporary file with content"
+
+        file_instance = open("/tmp/" + file_name, "w+")
+        file_instance.write(content)
+        file_instance.seek(0)
+        return file_instance
+
+    def create_directory(self):
+        "Create a temporary directory for write, removed after the test"
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, name, content):
+        "Write a file in the temporary directory and return its path"
+        path = os.path.join(self.directory, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(content)
+        return path